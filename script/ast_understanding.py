@@ -1,58 +1,123 @@
-from pyverilog.vparser.parser import parse
-from pyverilog.vparser.ast import Node, InstanceList, Instance, PortArg
-from graphviz import Digraph
+from pyverilog.vparser.ast import InstanceList, Instance, PortArg
 import argparse
+import json
+import sys
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR
 
-def print_and_create_ast(node, indent=0):
+# Characters joined into one write, large enough that the dump runs at disk speed
+WRITE_CHUNK_SIZE = 1 << 20
+
+
+def node_attribute(node):
+    """Return the (attribute, value) shown next to the class name of a node, or None."""
+    for attribute in ('name', 'varname', 'value'):
+        if hasattr(node, attribute):
+            return attribute, getattr(node, attribute)
+    return None
+
+
+def port_connections(node):
+    """Yield (internal port, external wire) for every port of every instance of an InstanceList."""
+    for inst in node.instances:
+        if isinstance(inst, Instance):
+            for port in inst.portlist:
+                if isinstance(port, PortArg):
+                    if hasattr(port.argname, "var"):
+                        temp_port_argname = port.argname.var
+                    elif hasattr(port.argname, "name"):
+                        temp_port_argname = port.argname.name
+                    else:
+                        temp_port_argname = port.argname
+                    yield port.portname, temp_port_argname
+
+
+def walk_ast(ast, max_depth=None):
+    """
+    Yield (node_id, parent_id, depth, node) in the order of a depth-first walk.
+
+    The walk keeps one iterator per level instead of recursing, so it never hits
+    the recursion limit and its memory only grows with the depth of the tree.
+    Children below max_depth are not visited.
+    """
+    node_id = 0
+    yield node_id, None, 0, ast
+    stack = [(node_id, iter(ast.children()))]
+    while stack:
+        parent_id, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        node_id += 1
+        depth = len(stack)
+        yield node_id, parent_id, depth, child
+        if max_depth is None or depth < max_depth:
+            stack.append((node_id, iter(child.children())))
+
+
+def ast_lines(ast, max_depth=None, node_types=None, output_format='text'):
     """
-    Recursively prints the structure of the AST node, and simultaneously creates nodes and edges in a Graphviz graph.
-    
-    Args:
-    - node: The current AST node.
-    - graph: The Graphviz Digraph object.
-    - indent: Current indentation level for printing.
-    - parent_id: The ID of the parent node, used to connect edges in the graph.
+    Yield the dump of the AST one line at a time, as indented text or as one JSON object per node.
+
+    Only the nodes whose class name is in node_types are dumped (all of them when
+    it is empty), their descendants are still walked.
     """
-    indent_str = "  " * indent
-    print(f"{indent_str}{node.__class__.__name__}", end="")
-    label = node.__class__.__name__
-
-    if hasattr(node, 'name'):
-        print(f" (name: {node.name})")
-        label += f"\nname: {node.name}"
-    elif hasattr(node, 'varname'):
-        print(f" (varname: {node.varname})")
-        label += f"\nvarname: {node.varname}"
-    elif hasattr(node, 'value'):
-        print(f" (value: {node.value})")
-        label += f"\nvalue: {node.value}"
+    for node_id, parent_id, depth, node in walk_ast(ast, max_depth):
+        kind = node.__class__.__name__
+        if node_types and kind not in node_types:
+            continue
+        attribute = node_attribute(node)
+        if output_format == 'jsonl':
+            record = {'id': node_id, 'parent': parent_id, 'depth': depth, 'type': kind, 'lineno': getattr(node, 'lineno', None)}
+            if attribute:
+                record[attribute[0]] = str(attribute[1])
+            if isinstance(node, InstanceList):
+                record['ports'] = [[str(portname), str(wire)] for portname, wire in port_connections(node)]
+            yield json.dumps(record) + "\n"
+            continue
+        indent_str = "  " * depth
+        yield f"{indent_str}{kind} ({attribute[0]}: {attribute[1]})\n" if attribute else f"{indent_str}{kind}\n"
+        if isinstance(node, InstanceList):
+            for portname, wire in port_connections(node):
+                yield f"{indent_str}  Internal port: {portname}, External wire: {wire}\n"
+
+
+def write_ast(ast, file=None, max_depth=None, node_types=None, output_format='text'):
+    """Write the dump of the AST to a file (default: stdout) in chunks of about WRITE_CHUNK_SIZE characters, return the number of lines."""
+    file = file or sys.stdout
+    chunk = []
+    size = 0
+    count = 0
+    for line in ast_lines(ast, max_depth, node_types, output_format):
+        chunk.append(line)
+        size += len(line)
+        count += 1
+        if size >= WRITE_CHUNK_SIZE:
+            file.write("".join(chunk))
+            chunk.clear()
+            size = 0
+    file.write("".join(chunk))
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dump the AST of a verilog file.")
+    parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
+    parser.add_argument("-macros", default="", help="Macros used to preprocess the verilog file, if any.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    parser.add_argument("-output", default=None, help="Write the dump to this file instead of stdout")
+    parser.add_argument("-max_depth", type=int, default=None, help="Do not dump the nodes deeper than this (the source node is at depth 0)")
+    parser.add_argument("-types", nargs="+", default=[], help="Only dump the nodes of these classes, eg, InstanceList Always Assign")
+    parser.add_argument("-format", choices=("text", "jsonl"), default="text", help="Indented text, or one JSON object per node with its id and parent id")
+    args = parser.parse_args()
+
+    # Parse the preprocessed file, or reuse the AST of identical content from an earlier run
+    parse_cache = ParseCache(args.cache_dir)
+    ast = parse_cache.load_ast(args.input_file, args.macros.split())
+    parse_cache.save_stats()
+
+    if args.output:
+        with open(args.output, 'w', buffering=WRITE_CHUNK_SIZE) as file:
+            write_ast(ast, file, args.max_depth, set(args.types), args.format)
     else:
-        print("")
-
-    if isinstance(node, InstanceList):
-        for inst in node.instances:
-            if isinstance(inst, Instance):
-                for port in inst.portlist:
-                    if isinstance(port, PortArg):
-                        # print(f'vars() = {vars(port)}')
-                        if hasattr(port.argname, "var"):
-                            temp_port_argname = port.argname.var
-                        elif hasattr(port.argname, "name"):
-                            temp_port_argname = port.argname.name
-                        else:
-                            temp_port_argname = port.argname
-                        print(f"{indent_str}  Internal port: {port.portname}, External wire: {temp_port_argname}")
-                        label += f"\n{port.portname} -> {port.argname}"
-
-    if hasattr(node, 'children'):
-        for child in node.children():
-            print_and_create_ast(child, indent + 1)
-
-parser = argparse.ArgumentParser(description="Generate a Verilog schematic diagram.")
-parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
-args = parser.parse_args()
-
-# Parse the preprocessed file
-ast, _ = parse([args.input_file])
-
-print_and_create_ast(ast)
+        write_ast(ast, None, args.max_depth, set(args.types), args.format)
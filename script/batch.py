@@ -0,0 +1,127 @@
+import argparse
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from export_netlist import add_export_arguments, export_formats
+from flatten_verilog import flatten_verilog
+from generate_schematic import add_schematic_arguments, schematic_options
+from module_index import ModuleIndex, design_files
+from parse_cache import add_frontend_argument, get_parser
+from profiling import aggregate
+from render_backend import add_render_arguments, render_options
+from schematic_builder import SchematicBuilder, run_stage
+from source_buffer import close_source_buffers
+
+# Per worker process state, set up once by init_worker and reused for every file.
+worker = {}
+
+
+def init_worker(design_dir, module_index_file, cache_dir, options, profile, export, render, frontend, render_options=None, keep_in_memory=False):
+    """Import everything, load the parser tables and the module index once per worker process."""
+    builder = worker['builder'] = SchematicBuilder(design_dir, module_index_file, cache_dir, frontend, keep_in_memory,
+                                                   options, render_options, export, render, profile)
+    worker['module_index'] = builder.module_index
+    worker['parse_cache'] = builder.parse_cache
+
+
+def build_and_render(result, flattened_file, output, macros):
+    worker['builder'].run(flattened_file, output, macros, result=result)
+
+
+def run_file(input_file, stages):
+    result = {'file': input_file, 'timings': {}, 'error': None}
+    try:
+        stages(result)
+    except Exception:
+        result['error'] = f"{result['stage']}: {traceback.format_exc(limit=3).strip().splitlines()[-1]}"
+    finally:
+        close_source_buffers()
+        worker['parse_cache'].save_stats()
+    return result
+
+
+def output_files(input_file, output_dir):
+    """Return the flattened file and the schematic (without extension) of a design file, named like make does."""
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    return (os.path.join(output_dir, 'flatten_verilog_files', f'{name}_flattened_verilog.v'),
+            os.path.join(output_dir, 'schematic_files', f'{name}_schematic'))
+
+
+def process_file(input_file, output_dir, macros):
+    """Run flatten -> parse -> graph build -> render for one design file and return its timings."""
+    flattened_file, output = output_files(input_file, output_dir)
+
+    def stages(result):
+        run_stage(result, 'flatten', flatten_verilog, input_file, flattened_file, macros)
+        build_and_render(result, flattened_file, output, macros)
+    return run_file(input_file, stages)
+
+
+def render_flattened_file(flattened_file, output):
+    """Run parse -> graph build -> render for an already flattened file and return its timings."""
+    return run_file(flattened_file, lambda result: build_and_render(result, flattened_file, output, ()))
+
+
+def run_in_pool(function, task_args, design_dir, module_index_file, cache_dir, jobs, options, profile=False, export=(), render=True, frontend='pyverilog', render_options=None):
+    """Run function(*args) for every tuple of task_args on warm worker processes and return the results."""
+    # Update the index and the parser tables once, the workers only read them.
+    ModuleIndex.load(design_dir, module_index_file).save()
+    get_parser(cache_dir)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(design_dir, module_index_file, cache_dir, options, profile, export, render, frontend, render_options)) as executor:
+        futures = [executor.submit(function, *args) for args in task_args]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+def print_summary(results, wall_time, jobs):
+    stages = ('flatten', 'parse', 'export', 'build', 'render')
+    print(f"\n{'file':40s} " + " ".join(f"{stage:>8s}" for stage in stages) + f" {'total':>8s}  status")
+    busy_time = 0.0
+    for result in sorted(results, key=lambda result: -sum(result['timings'].values())):
+        total = sum(result['timings'].values())
+        busy_time += total
+        columns = " ".join(f"{result['timings'][stage]:8.2f}" if stage in result['timings'] else f"{'-':>8s}" for stage in stages)
+        status = 'FAILED ' + result['error'] if result['error'] else ('ok (cached)' if result.get('cache_hit') else 'ok')
+        print(f"{os.path.basename(result['file']):40s} {columns} {total:8.2f}  {status}")
+    failures = [result for result in results if result['error']]
+    print(f"\n{len(results)} file(s), {len(failures)} failure(s), {jobs} worker(s)")
+    print(f"wall time {wall_time:.2f}s, summed file time {busy_time:.2f}s, speedup {busy_time / max(wall_time, 1e-9):.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the schematics of a whole design with a pool of worker processes.")
+    parser.add_argument("-design_dir", required=True, help="Path to all the verilog files")
+    parser.add_argument("-output_dir", default="output", help="Path to the output directory")
+    parser.add_argument("-macros", default="", help="Macros used to flatten the verilog files, if any.")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <output_dir>/module_index.json)")
+    parser.add_argument("-cache_dir", default=".cache", help="Path to the parser table and parse result cache")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="Number of worker processes (default: number of cores)")
+    add_schematic_arguments(parser)
+    parser.add_argument("-profile", "--profile", action="store_true", help="Save a <name>_schematic.profile.json next to every schematic and print the aggregated profile")
+    add_export_arguments(parser)
+    add_frontend_argument(parser)
+    parser.add_argument("-no_render", action="store_true", help="Do not build and render the schematics, only export the netlists")
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    macros = args.macros.split()
+    module_index_file = args.module_index or os.path.join(args.output_dir, 'module_index.json')
+    for directory in ('flatten_verilog_files', 'schematic_files'):
+        os.makedirs(os.path.join(args.output_dir, directory), exist_ok=True)
+
+    start = time.perf_counter()
+    task_args = [(input_file, args.output_dir, macros) for input_file in design_files(args.design_dir)]
+    results = run_in_pool(process_file, task_args, args.design_dir, module_index_file, args.cache_dir, args.jobs, schematic_options(args), args.profile,
+                          export_formats(args.export) if args.export else (), not args.no_render, args.frontend, render_options(args))
+    print_summary(results, time.perf_counter() - start, args.jobs)
+    if args.profile:
+        print()
+        aggregate(glob.glob(os.path.join(args.output_dir, 'schematic_files', '*.profile.json')), 20)
+    if any(result['error'] for result in results):
+        raise SystemExit(1)
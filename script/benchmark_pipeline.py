@@ -0,0 +1,232 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import tempfile
+import time
+from ast_understanding import write_ast
+from design_tables import collect_design_tables
+from generate_schematic import create_schematic_from_tables, render_schematic, add_schematic_arguments, schematic_options
+from module_index import ModuleIndex, design_files
+from parse_cache import DEFAULT_CACHE_DIR, get_parser, parse_file
+from source_buffer import close_source_buffers
+
+STAGES = ('module_index', 'parse', 'tables', 'build', 'dot_source', 'render', 'ast_dump')
+
+
+def nested_expression(operands, depth):
+    """Return an expression of the operands nested depth parentheses deep."""
+    expression = operands[0]
+    for level in range(depth):
+        expression = f"({expression} {'^&|'[level % 3]} {operands[(level + 1) % len(operands)]})"
+    return expression
+
+
+def generate_module(name, assigns, always_blocks, instances, depth, fanout, bus_width):
+    """
+    Return the text of one synthetic module.
+
+    Every register is read by fanout assigns and every assign by fanout always
+    blocks and instances. Expressions are depth operators deep, always blocks have
+    depth nested ifs and part-selects of bus_width wide buses are used everywhere.
+    """
+    msb = bus_width - 1
+    half = max(bus_width // 2, 1)
+    lines = [f"module {name}(clk, rst, din, dout);", "  input clk;", "  input rst;", f"  input [{msb}:0] din;", f"  output [{msb}:0] dout;"]
+    lines += [f"  wire [{msb}:0] w{i};" for i in range(assigns)]
+    lines += [f"  reg [{msb}:0] r{i};" for i in range(always_blocks)]
+    lines += [f"  wire [7:0] y{i};" for i in range(instances)]
+
+    def register(i):
+        return f"r{i // fanout}" if i // fanout < always_blocks else "din"
+
+    def assigned_wire(i):
+        return f"w{i // fanout}" if i // fanout < assigns else "din"
+
+    for i in range(assigns):
+        source = register(i)
+        lines.append(f"  assign w{i} = {nested_expression([source, f'din[{msb}:{msb - half + 1}]', f'{source}[{i % bus_width}]'], depth)};")
+    for i in range(always_blocks):
+        source = assigned_wire(i)
+        lines.append("  always @(posedge clk) begin")
+        lines.append(f"    if (rst) r{i} <= {bus_width}'h0;")
+        lines.append("    else begin")
+        for level in range(depth):
+            lines.append("      " + "  " * level + f"if ({source}[{level % bus_width}]) begin")
+        lines.append("      " + "  " * depth + f"r{i}[{half - 1}:0] <= {source}[{msb}:{msb - half + 1}];")
+        for level in reversed(range(depth)):
+            lines.append("      " + "  " * level + "end")
+        lines.append("    end")
+        lines.append("  end")
+    for i in range(instances):
+        lines.append(f"  bench_leaf u_leaf{i} (.clk(clk), .a({assigned_wire(i)}[{msb}:0]), .y(y{i}));")
+    lines.append(f"  assign dout = {'r0' if always_blocks else 'din'};")
+    lines.append("endmodule")
+    return "\n".join(lines) + "\n"
+
+
+def generate_design(design_dir, assigns, always_blocks, instances, files, depth, fanout, bus_width):
+    """Write a synthetic design split over files modules, plus the bench_leaf module, and return its number of lines."""
+    os.makedirs(design_dir, exist_ok=True)
+    line_count = 0
+    with open(os.path.join(design_dir, 'bench_leaf.v'), 'w') as file:
+        text = "\n".join([
+            "module bench_leaf(clk, a, y);", "  input clk;", f"  input [{bus_width - 1}:0] a;", "  output [7:0] y;", "  reg [7:0] y;",
+            f"  always @(posedge clk) y <= a[{min(bus_width, 8) - 1}:0];", "endmodule"]) + "\n"
+        file.write(text)
+        line_count += text.count("\n")
+    for k in range(files):
+        def share(total):
+            return total // files + (k < total % files)
+        text = generate_module(f"bench_{k}", share(assigns), share(always_blocks), share(instances), depth, fanout, bus_width)
+        with open(os.path.join(design_dir, f'bench_{k}.v'), 'w') as file:
+            file.write(text)
+        line_count += text.count("\n")
+    return line_count
+
+
+def run_pipeline(design_dir, output_dir, cache_dir, render, options):
+    """Run every stage of the schematic pipeline on every file of the design and return the summed time of each stage."""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    def timed(stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+
+    index_file = os.path.join(output_dir, 'module_index.json')
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    module_index = timed('module_index', ModuleIndex.load, design_dir, index_file)
+    for input_file in design_files(design_dir):
+        output = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + '_schematic')
+        ast = timed('parse', parse_file, input_file, (), cache_dir)
+        tables = timed('tables', collect_design_tables, ast)
+        with contextlib.redirect_stdout(io.StringIO()):
+            schematic = timed('build', create_schematic_from_tables, tables, input_file, module_index, **options)
+            timed('dot_source', lambda: schematic.source)
+            if render:
+                timed('render', render_schematic, schematic, output)
+        with open(os.devnull, 'w') as dump:
+            timed('ast_dump', write_ast, ast, dump)
+        close_source_buffers()
+    if not render:
+        del timings['render']
+    return timings
+
+
+def scaling_exponents(results):
+    """Least squares slope of log(time) against log(scale) for every stage: 1.0 is linear, 2.0 quadratic."""
+    exponents = {}
+    stages = {stage for timings in results.values() for stage in timings}
+    for stage in stages:
+        points = [(math.log(float(scale)), math.log(timings[stage])) for scale, timings in results.items()
+                  if timings.get(stage, 0) > 0]
+        if len(points) < 2:
+            continue
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        spread = sum((x - mean_x) ** 2 for x, _ in points)
+        if spread > 0:
+            exponents[stage] = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+    return exponents
+
+
+def compare_with_baseline(report, baseline, tolerance, exponent_tolerance, min_time):
+    """Return the list of regressions of report against baseline."""
+    regressions = []
+    for scale, timings in report['results'].items():
+        for stage, seconds in timings.items():
+            reference = baseline['results'].get(scale, {}).get(stage)
+            if reference is None or math.isnan(seconds):
+                continue
+            if seconds > max(reference * (1 + tolerance), min_time):
+                regressions.append(f"{stage} at scale {scale}: {seconds:.3f}s, baseline {reference:.3f}s (+{100 * (seconds / max(reference, 1e-9) - 1):.0f}%)")
+    for stage, exponent in report['exponents'].items():
+        reference = baseline['exponents'].get(stage)
+        # The slope of stages that never take min_time is timer noise
+        longest = max((timings.get(stage, 0) for timings in report['results'].values()), default=0)
+        if longest < min_time:
+            continue
+        if reference is not None and exponent > reference + exponent_tolerance:
+            regressions.append(f"{stage} scales as n^{exponent:.2f}, baseline n^{reference:.2f}")
+    return regressions
+
+
+def print_report(report):
+    stages = [stage for stage in STAGES if any(stage in timings for timings in report['results'].values())]
+    print(f"\n{'scale':>6s} {'statements':>10s} {'lines':>8s} " + " ".join(f"{stage:>12s}" for stage in stages))
+    for scale, timings in report['results'].items():
+        size = report['sizes'][scale]
+        print(f"{scale:>6s} {size['statements']:10d} {size['lines']:8d} " + " ".join(f"{timings[stage]:11.3f}s" for stage in stages))
+    if report['exponents']:
+        print(f"{'n^k':>26s} " + " ".join(f"{report['exponents'][stage]:12.2f}" if stage in report['exponents'] else f"{'-':>12s}" for stage in stages))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage of the schematic pipeline on synthetic designs of growing size and compare with a baseline.")
+    parser.add_argument("-assigns", type=int, default=500, help="Number of assign statements of the design at scale 1")
+    parser.add_argument("-always_blocks", type=int, default=500, help="Number of always blocks of the design at scale 1")
+    parser.add_argument("-instances", type=int, default=50, help="Number of instances of the design at scale 1")
+    parser.add_argument("-files", type=int, default=4, help="Number of files (modules) the design is split into")
+    parser.add_argument("-depth", type=int, default=4, help="Nesting depth of expressions and of the ifs of always blocks")
+    parser.add_argument("-fanout", type=int, default=4, help="Number of statements reading every assign and register")
+    parser.add_argument("-bus_width", type=int, default=32, help="Width of the buses")
+    parser.add_argument("-scales", type=int, nargs="+", default=[1, 2, 4], help="Multipliers of the statements and instances, one design per scale")
+    parser.add_argument("-repeat", type=int, default=1, help="Number of runs at every scale, the best time of every stage is kept")
+    parser.add_argument("-render", action="store_true", help="Also render the schematics with dot")
+    parser.add_argument("-work_dir", default=None, help="Keep the generated designs and schematics in this directory (default: a temporary directory)")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table cache (parse results are never cached here)")
+    parser.add_argument("-baseline", default="benchmark_baseline.json", help="Baseline file to compare with")
+    parser.add_argument("-save_baseline", action="store_true", help="Save the results as the new baseline instead of comparing")
+    parser.add_argument("-tolerance", type=float, default=0.25, help="Allowed slowdown of a stage before it is reported as a regression")
+    parser.add_argument("-exponent_tolerance", type=float, default=0.2, help="Allowed increase of the scaling exponent of a stage")
+    parser.add_argument("-min_time", type=float, default=0.05, help="Stages faster than this many seconds are never reported")
+    add_schematic_arguments(parser)
+    args = parser.parse_args()
+
+    design = {name: getattr(args, name) for name in ('assigns', 'always_blocks', 'instances', 'files', 'depth', 'fanout', 'bus_width', 'render')}
+    design.update(schematic_options(args))
+    report = {'design': design, 'results': {}, 'sizes': {}, 'exponents': {}}
+    get_parser(args.cache_dir)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        work_dir = args.work_dir or temporary_dir
+        for scale in args.scales:
+            scale_dir = os.path.join(work_dir, f'scale_{scale}')
+            design_dir = os.path.join(scale_dir, 'design')
+            output_dir = os.path.join(scale_dir, 'output')
+            os.makedirs(output_dir, exist_ok=True)
+            lines = generate_design(design_dir, args.assigns * scale, args.always_blocks * scale, args.instances * scale,
+                                    args.files, args.depth, args.fanout, args.bus_width)
+            best = None
+            for _ in range(args.repeat):
+                timings = run_pipeline(design_dir, output_dir, args.cache_dir, args.render, schematic_options(args))
+                best = timings if best is None else {stage: min(best[stage], seconds) for stage, seconds in timings.items()}
+            report['results'][str(scale)] = best
+            report['sizes'][str(scale)] = {'statements': (args.assigns + args.always_blocks) * scale, 'instances': args.instances * scale, 'lines': lines}
+            print(f"scale {scale}: {lines} lines, {sum(seconds for seconds in best.values() if not math.isnan(seconds)):.2f}s")
+    report['exponents'] = scaling_exponents(report['results'])
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nBaseline saved as '{args.baseline}'")
+    elif not os.path.exists(args.baseline):
+        print(f"\nNo baseline '{args.baseline}' to compare with, create one with -save_baseline")
+    else:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline['design'] != report['design']:
+            print(f"\nThe baseline '{args.baseline}' was recorded with another design, not compared")
+        else:
+            regressions = compare_with_baseline(report, baseline, args.tolerance, args.exponent_tolerance, args.min_time)
+            print(f"\n{len(regressions)} regression(s) against '{args.baseline}'")
+            for regression in regressions:
+                print(f"  {regression}")
+            if regressions:
+                raise SystemExit(1)
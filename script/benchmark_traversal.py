@@ -0,0 +1,147 @@
+from pyverilog.vparser.parser import VerilogParser
+from design_tables import collect_design_tables
+from structural_frontend import StructuralScanner
+import argparse
+import tempfile
+import time
+
+
+def generate_flattened_netlist(statements, instances, expression_depth):
+    """Return the text of a large flattened module with the given number of assigns, always blocks and instances."""
+    lines = ["module bench_top(clk, rst, din, dout);", "  input clk;", "  input rst;", "  input [31:0] din;", "  output [31:0] dout;"]
+    for i in range(statements):
+        lines.append(f"  wire [31:0] w{i};")
+        lines.append(f"  reg [31:0] r{i};")
+    previous = "din"
+    for i in range(statements):
+        operands = " ^ ".join([previous] + [f"din[{(i + j) % 32}]" for j in range(expression_depth)])
+        lines.append(f"  assign w{i} = {operands};")
+        lines.append(f"  always @(posedge clk) begin")
+        lines.append(f"    if (rst) r{i} <= 32'h0;")
+        lines.append(f"    else r{i}[15:0] <= w{i}[15:0];")
+        lines.append(f"  end")
+        previous = f"r{i}"
+    for i in range(instances):
+        lines.append(f"  bench_leaf u_leaf{i} (.clk(clk), .a(r{i % max(statements, 1)}), .y(w{i % max(statements, 1)}[7:0]));")
+    lines.append(f"  assign dout = {previous};")
+    lines.append("endmodule")
+    return "\n".join(lines) + "\n"
+
+
+def legacy_traversal(ast):
+    """The five recursive walks create_schematic_from_ast used to make over the AST."""
+    declared = {}
+    inputs = []
+    outputs = []
+    statements = []
+    instances = []
+
+    def all_decalared_signals(node):
+        if node.__class__.__name__ in ('Input', 'Inout', 'Output', 'Wire', 'Reg'):
+            declared[node.name] = 0 if node.width == None else {'msb': node.width.msb, 'lsb': node.width.lsb}
+        for child in node.children():
+            all_decalared_signals(child)
+
+    def add_ports(node, kind, ports):
+        if node.__class__.__name__ == kind:
+            ports.append(node.name)
+        for child in node.children():
+            add_ports(child, kind, ports)
+
+    def l_value_extractor(node):
+        if hasattr(node, 'name'):
+            return str(node.name)
+        for child in node.children():
+            result = l_value_extractor(child)
+            if result is not None:
+                return result
+
+    def signal_extractor(node, signal_dict):
+        if node.__class__.__name__ == 'Lvalue':
+            signal_dict["output"].add(l_value_extractor(node))
+        elif hasattr(node, 'name'):
+            signal_dict["input"].add(node.name)
+        elif hasattr(node, 'value'):
+            signal_dict["input"].add(node.value)
+        for child in node.children():
+            signal_extractor(child, signal_dict)
+        return signal_dict
+
+    def add_statements(node):
+        if node.__class__.__name__ in ('Always', 'Assign', 'Decl'):
+            statements.append(signal_extractor(node, {"input": set(), "output": set()}))
+        for child in node.children():
+            add_statements(child)
+
+    def add_instances(node):
+        if node.__class__.__name__ == 'InstanceList':
+            instances.append(node.instances[0])
+        for child in node.children():
+            add_instances(child)
+
+    all_decalared_signals(ast)
+    add_ports(ast, 'Input', inputs)
+    add_ports(ast, 'Output', outputs)
+    add_statements(ast)
+    add_instances(ast)
+    return declared, inputs, outputs, statements, instances
+
+
+def table_contents(tables):
+    """Comparable view of DesignTables, expressions are compared through their text."""
+    return {
+        'ports': (tables.input_ports, tables.output_ports),
+        'declarations': sorted((name, str(width)) for name, width in tables.declarations.items()),
+        'statements': sorted((statement.kind, sorted(map(str, statement.inputs)), sorted(map(str, statement.outputs)))
+                             for statement in tables.statements),
+        'instances': sorted((instance.module, instance.name, [str(port) for port in instance.ports]) for instance in tables.instances),
+    }
+
+
+def best_time(function, ast, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(ast)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the old recursive AST walks with the single-pass visitor and the structural frontend.")
+    parser.add_argument("-input_file", default=None, help="Flattened verilog file to benchmark (default: a generated netlist)")
+    parser.add_argument("-statements", type=int, default=5000, help="Number of assign/always pairs of the generated netlist")
+    parser.add_argument("-instances", type=int, default=500, help="Number of instances of the generated netlist")
+    parser.add_argument("-expression_depth", type=int, default=8, help="Number of operands of every generated assign")
+    parser.add_argument("-repeat", type=int, default=3, help="Number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    if args.input_file:
+        with open(args.input_file, 'r') as file:
+            text = file.read()
+    else:
+        text = generate_flattened_netlist(args.statements, args.instances, args.expression_depth)
+
+    with tempfile.TemporaryDirectory() as parser_dir:
+        start = time.perf_counter()
+        ast = VerilogParser(outputdir=parser_dir, debug=False).parse(text)
+        print(f"parse: {time.perf_counter() - start:.3f}s for {text.count(chr(10))} lines")
+
+    try:
+        legacy = best_time(legacy_traversal, ast, args.repeat)
+        print(f"five recursive walks: {legacy:.3f}s")
+    except RecursionError:
+        legacy = None
+        print("five recursive walks: RecursionError")
+    single_pass = best_time(collect_design_tables, ast, args.repeat)
+    print(f"single-pass visitor:  {single_pass:.3f}s")
+    if legacy:
+        print(f"speedup: {legacy / single_pass:.2f}x")
+
+    data = text.encode()
+    structural = best_time(lambda data: StructuralScanner(data).scan(), data, args.repeat)
+    print(f"structural frontend:  {structural:.3f}s (tokenize and scan, no parse)")
+    expected = table_contents(collect_design_tables(ast))
+    scanned = table_contents(StructuralScanner(data).scan())
+    for name in expected:
+        print(f"  {name}: {'same' if expected[name] == scanned[name] else 'DIFFERENT'}")
@@ -0,0 +1,67 @@
+import argparse
+import time
+from cone_index import load_cone_index
+from design_tables import DesignTables
+from generate_schematic import create_schematic_from_tables, render_schematic, add_schematic_arguments, schematic_options
+from module_index import ModuleIndex, default_index_file
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, add_frontend_argument
+from render_backend import add_render_arguments, render_options
+
+
+def cone_tables(tables, nodes, signal):
+    """DesignTables with only the statements, instances and ports of a cone, drawn like a whole module."""
+    names = {node_name for _, node_name in nodes}
+    instance_names = {node_name.split('.')[0] for node_name in names if '.' in node_name}
+    nets = {signal.split('[')[0].strip()}
+    for statement in tables.statements:
+        if statement.name in names:
+            nets |= statement.inputs | statement.outputs
+    for instance in tables.instances:
+        if instance.name in instance_names:
+            nets |= {port.external_wire for port in instance.ports}
+    cone = DesignTables()
+    cone.declarations = tables.declarations
+    cone.input_ports = [port_name for port_name in tables.input_ports if port_name in nets]
+    cone.output_ports = [port_name for port_name in tables.output_ports if port_name in nets]
+    cone.statements = [statement for statement in tables.statements if statement.name in names]
+    cone.instances = [instance for instance in tables.instances if instance.name in instance_names]
+    return cone
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print and draw the fan-in or fan-out cone of signals of a verilog file.")
+    parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
+    parser.add_argument("-signal", required=True, nargs="+", help="Signals to query")
+    parser.add_argument("-depth", type=int, default=0, help="Number of levels of the cone (default: 0, the whole cone)")
+    parser.add_argument("-direction", choices=("fanin", "fanout"), default="fanin", help="Walk towards the drivers (fanin) or the readers (fanout)")
+    parser.add_argument("-output", default=None, help="Render the cone of every signal to <output>_<signal>.svg")
+    parser.add_argument("-design_dir", required=True, help="Path to all the verilog files")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <cache_dir>/module_index/<hash of design_dir>.json)")
+    parser.add_argument("-macros", default="", help="Macros used to preprocess the verilog file, if any.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    add_frontend_argument(parser)
+    add_schematic_arguments(parser)
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    module_index = ModuleIndex.load(args.design_dir, args.module_index or default_index_file(args.design_dir, args.cache_dir))
+    module_index.save()
+    parse_cache = ParseCache(args.cache_dir, frontend=args.frontend)
+    start = time.perf_counter()
+    tables, cone_index = load_cone_index(parse_cache, args.input_file, args.macros.split(), module_index)
+    print(f"Cone index of '{args.input_file}' ready in {1000 * (time.perf_counter() - start):.1f} ms")
+
+    for signal in args.signal:
+        start = time.perf_counter()
+        try:
+            nodes = cone_index.cone(signal, args.depth, args.direction)
+        except KeyError as error:
+            print(f"Error: {error.args[0]} in '{args.input_file}'")
+            continue
+        print(f"\n{args.direction} cone of {signal}: {len(nodes)} node(s) in {1000 * (time.perf_counter() - start):.3f} ms")
+        for level, node_name in nodes:
+            print(f"  {level:3d}  {node_name:40s} line {cone_index.node_lines.get(node_name, '-')}")
+        if args.output:
+            schematic = create_schematic_from_tables(cone_tables(tables, nodes, signal), args.input_file, module_index, **schematic_options(args))
+            render_schematic(schematic, f"{args.output}_{signal.split('[')[0].strip()}", **render_options(args))
+    parse_cache.report()
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from array import array
+from export_netlist import connectivity, instance_port_directions
+from parse_cache import source_version
+
+
+class ConeIndex:
+    """
+    Connectivity of one file prepared for cone queries.
+
+    For every net the nodes driving and reading it, and for every node the nets it
+    reads and drives, all as arrays of integer ids. It is built once per file
+    content and kept in the parse cache, so a query is only a walk over arrays.
+    Instances are black boxes: every output port reads all the nets of the input
+    ports of its instance, so cones go through submodules.
+    """
+
+    def __init__(self, tables, module_index):
+        netlist = connectivity(tables, module_index)
+        self.net_ids = netlist.net_ids
+        self.net_names = netlist.net_names
+        self.node_names = netlist.node_names
+        self.net_drivers = netlist.drivers
+        self.net_readers = netlist.readers
+        self.node_inputs = [array('I') for _ in self.node_names]
+        self.node_outputs = [array('I') for _ in self.node_names]
+        for net_id in range(len(self.net_names)):
+            for node_id in self.net_readers[net_id]:
+                self.node_inputs[node_id].append(net_id)
+            for node_id in self.net_drivers[net_id]:
+                self.node_outputs[node_id].append(net_id)
+        for instance in tables.instances:
+            port_nodes = {netlist.node_ids.get(f"{instance.name}.{port.portname}") for port in instance.ports} - {None}
+            input_nodes = [node_id for node_id in port_nodes if self.node_inputs[node_id]]
+            output_nodes = [node_id for node_id in port_nodes if self.node_outputs[node_id]]
+            read_nets = sorted({net_id for node_id in input_nodes for net_id in self.node_inputs[node_id]})
+            driven_nets = sorted({net_id for node_id in output_nodes for net_id in self.node_outputs[node_id]})
+            for node_id in output_nodes:
+                self.node_inputs[node_id].extend(read_nets)
+            for node_id in input_nodes:
+                self.node_outputs[node_id].extend(driven_nets)
+        # source line of every statement and instance port node
+        self.node_lines = {statement.name: statement.lineno for statement in tables.statements}
+        for instance in tables.instances:
+            for port in instance.ports:
+                self.node_lines[f"{instance.name}.{port.portname}"] = instance.lineno
+
+    def cone(self, signal, depth=0, direction='fanin'):
+        """
+        Return [(level, node name)] of the transitive fan-in or fan-out cone of a signal.
+
+        Level 1 are the nodes driving (fanin) or reading (fanout) the signal itself,
+        the walk stops after depth levels (0 for no limit) or when nothing new is reached.
+        """
+        net_id = self.net_ids.get(signal.split('[')[0].strip())
+        if net_id is None:
+            raise KeyError(f"no net named '{signal}'")
+        net_nodes, node_nets = (self.net_drivers, self.node_inputs) if direction == 'fanin' else (self.net_readers, self.node_outputs)
+        seen_nets = {net_id}
+        seen_nodes = set()
+        frontier = [net_id]
+        result = []
+        level = 0
+        while frontier and (depth == 0 or level < depth):
+            level += 1
+            next_frontier = []
+            for net_id in frontier:
+                for node_id in net_nodes[net_id]:
+                    if node_id in seen_nodes:
+                        continue
+                    seen_nodes.add(node_id)
+                    result.append((level, self.node_names[node_id]))
+                    for next_net in node_nets[node_id]:
+                        if next_net not in seen_nets:
+                            seen_nets.add(next_net)
+                            next_frontier.append(next_net)
+            frontier = next_frontier
+        return result
+
+
+def index_version(tables, module_index):
+    """Version of the cone index of a file: this code and the ports of the modules it instantiates."""
+    digest = hashlib.sha1(source_version(sys.modules[__name__]).encode())
+    for instance in tables.instances:
+        digest.update(json.dumps([instance.module, instance_port_directions(instance, module_index)], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def load_cone_index(parse_cache, input_file, macros, module_index):
+    tables = parse_cache.load_design_tables(input_file, macros)
+    cone_index = parse_cache.load('cone_index', input_file, macros, lambda: ConeIndex(tables, module_index),
+                                  version=index_version(tables, module_index) + parse_cache.frontend)
+    return tables, cone_index
+
+
+def check_instance_cone():
+    """Check that the fan-in of a signal driven by an instance reaches the statements feeding the instance inputs."""
+    from module_index import ModuleIndex
+    from structural_frontend import scan_design_tables
+    with tempfile.TemporaryDirectory() as design_dir:
+        with open(os.path.join(design_dir, 'sub.v'), 'w') as file:
+            file.write("module sub (input clk, input [3:0] d, output reg [3:0] q);\n  always @(posedge clk) q <= d;\nendmodule\n")
+        top_file = os.path.join(design_dir, 'top.v')
+        with open(top_file, 'w') as file:
+            file.write("module top (input clk, input [3:0] a, output [3:0] q);\n  reg [3:0] r;\n  wire [3:0] w;\n"
+                       "  always @(posedge clk) r <= a;\n  assign w = r + 1;\n  sub u_sub (.clk(clk), .d(w), .q(q));\nendmodule\n")
+        module_index = ModuleIndex(design_dir, os.path.join(design_dir, 'module_index.json'))
+        module_index.refresh()
+        cone_index = ConeIndex(scan_design_tables(top_file), module_index)
+    fanin = [node_name for _, node_name in cone_index.cone('q')]
+    assert fanin == ['u_sub.q', 'assign_0', 'always_0'], fanin
+    fanout = [node_name for _, node_name in cone_index.cone('r', direction='fanout')]
+    assert fanout == ['assign_0', 'u_sub.d'], fanout
+    print("Cone through one instance: ok")
+
+
+if __name__ == "__main__":
+    check_instance_cone()
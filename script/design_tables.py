@@ -0,0 +1,109 @@
+from collections import namedtuple
+
+# One always block, assign statement or wire declaration with an assignment.
+# inputs/outputs are the signal names read and driven by the statement.
+Statement = namedtuple('Statement', ['kind', 'name', 'lineno', 'inputs', 'outputs'])
+# One port connection of an instance, external_wire is the connected signal name as a string
+# and msb/lsb are the part select of the connection (None if the whole signal is connected).
+PortConnection = namedtuple('PortConnection', ['portname', 'external_wire', 'msb', 'lsb'])
+Instance = namedtuple('Instance', ['name', 'module', 'lineno', 'ports'])
+
+declaration_kinds = ('Input', 'Inout', 'Output', 'Wire', 'Reg')
+statement_kinds = {'Always': 'always', 'Assign': 'assign', 'Decl': 'wire'}
+
+
+class DesignTables:
+    """Everything the schematic needs from a parsed module, collected in a single AST traversal."""
+
+    def __init__(self):
+        # signal name -> 0 for a single bit signal or {'msb': node, 'lsb': node}
+        self.declarations = {}
+        self.input_ports = []
+        self.output_ports = []
+        self.statements = []
+        self.instances = []
+
+
+def port_external_wire(argname):
+    """Return the name of the signal connected to an instance port as a string."""
+    if hasattr(argname, "var"):
+        return str(argname.var)
+    elif hasattr(argname, "name"):
+        return str(argname.name)
+    return str(argname)
+
+
+def instance_record(node):
+    """Build the Instance record of an InstanceList node (only the first instance is drawn)."""
+    inst = node.instances[0]
+    ports = []
+    for port in inst.portlist:
+        argname = port.argname
+        if (argname != None) and hasattr(argname, "msb"):
+            ports.append(PortConnection(port.portname, port_external_wire(argname), argname.msb, argname.lsb))
+        else:
+            ports.append(PortConnection(port.portname, port_external_wire(argname), None, None))
+    return Instance(inst.name, inst.module, node.lineno, ports)
+
+
+def collect_design_tables(ast):
+    """
+    Walk the AST once with an explicit stack and fill a DesignTables.
+
+    Every node reached below an always/assign/wire statement adds its signal to the
+    inputs of all enclosing statements, and the first named node below an Lvalue is
+    the signal driven by them. Nothing recurses, so deep expression trees of
+    generated RTL can not hit the Python recursion limit.
+    """
+    tables = DesignTables()
+    counters = {kind: 0 for kind in statement_kinds.values()}
+    # (node, enclosing statements, pending lvalue of the enclosing statements or None)
+    stack = [(ast, (), None)]
+    while stack:
+        node, statements, lvalue = stack.pop()
+        kind = node.__class__.__name__
+
+        if kind in declaration_kinds:
+            if node.width == None:
+                tables.declarations[node.name] = 0
+            else:
+                tables.declarations[node.name] = {'msb': node.width.msb, 'lsb': node.width.lsb}
+            if kind == 'Input':
+                tables.input_ports.append(node.name)
+            elif kind == 'Output':
+                tables.output_ports.append(node.name)
+        elif kind == 'InstanceList':
+            tables.instances.append(instance_record(node))
+        elif kind in statement_kinds:
+            statement_kind = statement_kinds[kind]
+            statement = Statement(statement_kind, f"{statement_kind}_{counters[statement_kind]}", node.lineno, set(), set())
+            counters[statement_kind] += 1
+            tables.statements.append(statement)
+            statements = statements + (statement,)
+
+        if statements:
+            if kind == 'Lvalue':
+                lvalue = [statements]
+            elif hasattr(node, 'name'):
+                for statement in statements:
+                    statement.inputs.add(node.name)
+                if lvalue is not None and lvalue[0]:
+                    # The first named node below an Lvalue is the driven signal.
+                    for statement in lvalue[0]:
+                        statement.outputs.add(str(node.name))
+                    lvalue[0] = ()
+            elif isinstance(getattr(node, 'value', None), str):
+                # Constants hold their text, a Repeat holds the repeated Concat node, whose identifiers are walked as its children
+                for statement in statements:
+                    statement.inputs.add(node.value)
+
+        children = node.children() if hasattr(node, 'children') else ()
+        for child in reversed(children):
+            if child is not None:
+                stack.append((child, statements, lvalue))
+
+    # Wire declarations without an assignment are plain declarations, not statements.
+    tables.statements = [statement for statement in tables.statements if statement.kind != 'wire' or statement.outputs]
+    for statement in tables.statements:
+        statement.inputs.difference_update(statement.outputs)
+    return tables
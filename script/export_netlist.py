@@ -0,0 +1,303 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pyverilog.ast_code_generator.codegen import ASTCodeGenerator
+from module_index import ModuleIndex, default_index_file
+from netlist import Netlist
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, add_frontend_argument
+from source_buffer import get_source_buffer
+
+EXPORT_VERSION = 1
+BINARY_MAGIC = b'VSNL'
+NONE = 0xFFFFFFFF
+# Record width (in 32 bit words) of every section of the binary format, in file order
+SECTIONS = (
+    ('ports', 4),         # name, direction (0 input, 1 output), msb, lsb
+    ('declarations', 3),  # name, msb, lsb
+    ('statements', 4),    # name, kind, first line, last line
+    ('instances', 5),     # name, module, line, first binding, binding count
+    ('bindings', 5),      # port, net, msb, lsb, direction (0 input, 1 output, NONE unknown)
+    ('nodes', 1),         # name
+    ('nets', 5),          # name, first driver, driver count, first reader, reader count
+    ('refs', 1),          # node ids of the drivers and readers of the nets
+    ('string_offsets', 1),
+)
+HEADER = struct.Struct('<4sI' + 'I' * len(SECTIONS))
+DIRECTIONS = {'input': 0, 'output': 1}
+
+
+def expression_text(node):
+    """Verilog text of a width or part-select bound, None if there is none."""
+    if node is None:
+        return None
+    if hasattr(node, 'value'):
+        return str(node.value)
+    if hasattr(node, 'name'):
+        return str(node.name)
+    return ASTCodeGenerator().visit(node)
+
+
+def is_net(signal):
+    # Unconnected ports, literals (10, 4'hF, 'b1) and anything that is not a signal name are not nets
+    return isinstance(signal, str) and signal != 'None' and not signal.strip()[:1].isdigit() and not signal.startswith("'")
+
+
+def instance_port_directions(instance, module_index):
+    definition = module_index.lookup(instance.module) if module_index else None
+    return dict(definition['ports']) if definition else {}
+
+
+def connectivity(tables, module_index):
+    """
+    Netlist of the statements and instance ports of one file.
+
+    Statement nodes are named like in the schematic (always_0, assign_3), instance
+    ports are named <instance>.<port>. Ports of modules missing from the index
+    have no known direction and are left out of the driver and reader lists.
+    """
+    netlist = Netlist()
+    for port_name in tables.input_ports:
+        netlist.add_input_port(port_name)
+    for port_name in tables.output_ports:
+        netlist.add_output_port(port_name)
+    for statement in tables.statements:
+        for signal in statement.inputs:
+            if is_net(signal):
+                netlist.add_reader(signal, statement.name)
+        for signal in statement.outputs:
+            if is_net(signal):
+                netlist.add_driver(signal, statement.name)
+    for instance in tables.instances:
+        directions = instance_port_directions(instance, module_index)
+        for port in instance.ports:
+            if not is_net(port.external_wire):
+                continue
+            node_name = f"{instance.name}.{port.portname}"
+            if directions.get(port.portname) == 'input':
+                netlist.add_reader(port.external_wire, node_name)
+            elif directions.get(port.portname) == 'output':
+                netlist.add_driver(port.external_wire, node_name)
+            else:
+                netlist.net(port.external_wire)
+    return netlist
+
+
+def export_records(tables, input_file, module_index):
+    """Yield the netlist of one file as JSON-ready records, one per port, declaration, statement, instance and net."""
+    source_buffer = get_source_buffer(input_file)
+    yield {'type': 'file', 'file': input_file, 'version': EXPORT_VERSION}
+    for direction, ports in (('input', tables.input_ports), ('output', tables.output_ports)):
+        for port_name in ports:
+            width = tables.declarations.get(port_name) or {}
+            yield {'type': 'port', 'name': port_name, 'direction': direction,
+                   'msb': expression_text(width.get('msb')), 'lsb': expression_text(width.get('lsb'))}
+    for name, width in tables.declarations.items():
+        width = width or {}
+        yield {'type': 'declaration', 'name': name, 'msb': expression_text(width.get('msb')), 'lsb': expression_text(width.get('lsb'))}
+    for statement in tables.statements:
+        yield {'type': 'statement', 'name': statement.name, 'kind': statement.kind, 'lines': [statement.lineno, source_buffer.statement_end_lineno(statement.lineno)],
+               'inputs': sorted(signal for signal in statement.inputs if is_net(signal)), 'outputs': sorted(signal for signal in statement.outputs if is_net(signal))}
+    for instance in tables.instances:
+        directions = instance_port_directions(instance, module_index)
+        yield {'type': 'instance', 'name': instance.name, 'module': instance.module, 'line': instance.lineno,
+               'ports': [{'port': port.portname, 'net': port.external_wire, 'msb': expression_text(port.msb), 'lsb': expression_text(port.lsb),
+                          'direction': directions.get(port.portname)} for port in instance.ports]}
+    netlist = connectivity(tables, module_index)
+    for net_name, drivers, readers in netlist.nets():
+        yield {'type': 'net', 'name': net_name, 'input_port': netlist.is_input_port(net_name), 'output_port': netlist.is_output_port(net_name),
+               'drivers': drivers, 'readers': readers}
+
+
+def atomic_writer(filename, mode):
+    """Open a temporary file next to filename (creating its directory), the caller moves it in place with os.replace."""
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    temp_path = f'{filename}.{os.getpid()}.tmp'
+    return open(temp_path, mode), temp_path
+
+
+def write_jsonl(records, filename):
+    """Stream the records to a JSON Lines file, one record per line."""
+    file, temp_path = atomic_writer(filename, 'w')
+    with file:
+        for record in records:
+            file.write(json.dumps(record, separators=(',', ':')))
+            file.write('\n')
+    os.replace(temp_path, filename)
+
+
+def write_binary(records, filename):
+    """
+    Write the records in the compact binary format read by NetlistFile.
+
+    Every section is an array of little endian 32 bit words with records of a fixed
+    width, all names are ids into one string table, so the file can be memory-mapped
+    and read without parsing.
+    """
+    strings = {}
+    string_bytes = bytearray()
+    string_offsets = array('I', [0])
+    sections = {name: array('I') for name, _ in SECTIONS}
+
+    def string(text):
+        if text is None:
+            return NONE
+        string_id = strings.get(text)
+        if string_id is None:
+            string_id = strings[text] = len(string_offsets) - 1
+            string_bytes.extend(str(text).encode('utf-8'))
+            string_offsets.append(len(string_bytes))
+        return string_id
+
+    node_ids = {}
+
+    def node(node_name):
+        node_id = node_ids.get(node_name)
+        if node_id is None:
+            node_id = node_ids[node_name] = len(sections['nodes'])
+            sections['nodes'].append(string(node_name))
+        return node_id
+
+    for record in records:
+        kind = record['type']
+        if kind == 'port':
+            sections['ports'].extend((string(record['name']), DIRECTIONS[record['direction']], string(record['msb']), string(record['lsb'])))
+        elif kind == 'declaration':
+            sections['declarations'].extend((string(record['name']), string(record['msb']), string(record['lsb'])))
+        elif kind == 'statement':
+            sections['statements'].extend((string(record['name']), string(record['kind']), record['lines'][0], record['lines'][1]))
+        elif kind == 'instance':
+            sections['instances'].extend((string(record['name']), string(record['module']), record['line'],
+                                          len(sections['bindings']) // 5, len(record['ports'])))
+            for port in record['ports']:
+                sections['bindings'].extend((string(port['port']), string(port['net']), string(port['msb']), string(port['lsb']),
+                                             DIRECTIONS.get(port['direction'], NONE)))
+        elif kind == 'net':
+            refs = sections['refs']
+            first_driver = len(refs)
+            refs.extend(node(driver) for driver in record['drivers'])
+            first_reader = len(refs)
+            refs.extend(node(reader) for reader in record['readers'])
+            sections['nets'].extend((string(record['name']), first_driver, len(record['drivers']), first_reader, len(record['readers'])))
+    sections['string_offsets'] = string_offsets
+
+    if sys.byteorder == 'big':
+        for section in sections.values():
+            section.byteswap()
+    file, temp_path = atomic_writer(filename, 'wb')
+    with file:
+        file.write(HEADER.pack(BINARY_MAGIC, EXPORT_VERSION, *(len(sections[name]) for name, _ in SECTIONS)))
+        for name, _ in SECTIONS:
+            file.write(sections[name].tobytes())
+        file.write(string_bytes)
+    os.replace(temp_path, filename)
+
+
+class NetlistFile:
+    """
+    Memory-mapped reader of the binary netlist format.
+
+    Nothing is decoded up front: every section is a view of 32 bit words on the
+    mapped file and names are decoded from the string table when asked for.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *lengths = HEADER.unpack_from(self.data)
+        if magic != BINARY_MAGIC or version != EXPORT_VERSION:
+            raise ValueError(f"'{filename}' is not a version {EXPORT_VERSION} netlist file")
+        if sys.byteorder == 'big':
+            raise ValueError("the binary netlist format can only be memory-mapped on little endian machines")
+        self._view = memoryview(self.data)
+        words = self._view[HEADER.size:]
+        offset = 0
+        self.sections = {}
+        for (name, width), length in zip(SECTIONS, lengths):
+            self.sections[name] = words[offset:offset + 4 * length].cast('I')
+            offset += 4 * length
+        self.string_bytes = words[offset:]
+        self._net_ids = None
+
+    def string(self, string_id):
+        if string_id == NONE:
+            return None
+        offsets = self.sections['string_offsets']
+        return bytes(self.string_bytes[offsets[string_id]:offsets[string_id + 1]]).decode('utf-8')
+
+    def records(self, section):
+        width = dict(SECTIONS)[section]
+        words = self.sections[section]
+        for start in range(0, len(words), width):
+            yield words[start:start + width]
+
+    def net_names(self):
+        return [self.string(record[0]) for record in self.records('nets')]
+
+    def _node_names(self, first, count):
+        refs = self.sections['refs']
+        nodes = self.sections['nodes']
+        return [self.string(nodes[refs[ref]]) for ref in range(first, first + count)]
+
+    def net(self, net_name):
+        """Return (driver node names, reader node names) of a net, or None if the net does not exist."""
+        if self._net_ids is None:
+            self._net_ids = {name: net_id for net_id, name in enumerate(self.net_names())}
+        net_id = self._net_ids.get(net_name)
+        if net_id is None:
+            return None
+        _, first_driver, driver_count, first_reader, reader_count = self.sections['nets'][5 * net_id:5 * net_id + 5]
+        return self._node_names(first_driver, driver_count), self._node_names(first_reader, reader_count)
+
+    def close(self):
+        for section in self.sections.values():
+            section.release()
+        self.string_bytes.release()
+        self._view.release()
+        self.data.close()
+
+
+def export_netlist(tables, input_file, module_index, output, formats=('jsonl', 'binary')):
+    """Write <output>.netlist.jsonl and/or <output>.netlist.bin and return the names of the written files."""
+    written = []
+    if 'jsonl' in formats:
+        write_jsonl(export_records(tables, input_file, module_index), output + '.netlist.jsonl')
+        written.append(output + '.netlist.jsonl')
+    if 'binary' in formats:
+        write_binary(export_records(tables, input_file, module_index), output + '.netlist.bin')
+        written.append(output + '.netlist.bin')
+    return written
+
+
+def add_export_arguments(parser):
+    parser.add_argument("-export", choices=("jsonl", "binary", "both"), default=None, help="Also export the netlist as JSON Lines, compact binary or both")
+
+
+def export_formats(export):
+    return ('jsonl', 'binary') if export == 'both' else (export,)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the netlist of a verilog file as JSON Lines and/or a compact binary file, without running dot.")
+    parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
+    parser.add_argument("-output", required=True, help="Path of the netlist files (without extension)")
+    parser.add_argument("-design_dir", default=None, help="Path to all the verilog files, gives the direction of instance ports")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <cache_dir>/module_index/<hash of design_dir>.json)")
+    parser.add_argument("-macros", default="", help="Macros used to preprocess the verilog file, if any.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    add_frontend_argument(parser)
+    parser.add_argument("-format", choices=("jsonl", "binary", "both"), default="both", help="Format of the export")
+    args = parser.parse_args()
+
+    module_index = None
+    if args.design_dir:
+        module_index = ModuleIndex.load(args.design_dir, args.module_index or default_index_file(args.design_dir, args.cache_dir))
+        module_index.save()
+    parse_cache = ParseCache(args.cache_dir, frontend=args.frontend)
+    tables = parse_cache.load_design_tables(args.input_file, args.macros.split())
+    for filename in export_netlist(tables, args.input_file, module_index, args.output, export_formats(args.format)):
+        print(f"Netlist saved as '{filename}'")
+    parse_cache.report()
@@ -1,14 +1,103 @@
 import subprocess
 import argparse
+import hashlib
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from module_index import design_files
 
-parser = argparse.ArgumentParser(description="Generate a Verilog schematic diagram.")
-parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
-parser.add_argument("-output", required=True, help="Path to the output schematic file (without extension)")
-parser.add_argument("-macros", required=True, help="Please give the macros for the verilog file, if any.")
+# An included header can change without the file including it, those files are always preprocessed again
+INCLUDE_PATTERN = re.compile(rb'`include\b')
 
-args = parser.parse_args()
+def stamp_key(data, macros):
+    """Hash of the input content and the macro set the output was produced with."""
+    return hashlib.sha256(data + b'\0' + ' '.join(sorted(macros)).encode()).hexdigest()
 
-macros = args.macros
-macros = macros.split()
-# Preprocess the Verilog file using iverilog
-subprocess.run(['iverilog', '-E'] + [f'-D{macro}' for macro in macros] + [args.input_file, '-o', args.output], check=True)
\ No newline at end of file
+def replace_with_copy(input_file, output):
+    """Copy the input to the output, replacing an existing output in one step. The copy gets a fresh mtime for make."""
+    temporary_file = f"{output}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(input_file, temporary_file)
+        os.replace(temporary_file, output)
+    finally:
+        if os.path.lexists(temporary_file):
+            os.remove(temporary_file)
+
+def flatten_verilog(input_file, output, macros):
+    """
+    Preprocess one verilog file with the given macros and return what was done.
+
+    Returns 'unchanged' if the output was already produced from the same content
+    and macros, 'copied' if the file has no compiler directive (so iverilog would
+    not change it) and 'preprocessed' if iverilog was run. A file with an
+    `include is never 'unchanged', its headers are not part of the stamp.
+    """
+    with open(input_file, 'rb') as file:
+        data = file.read()
+    key = stamp_key(data, macros)
+    stamp_file = output + '.stamp'
+    if not INCLUDE_PATTERN.search(data):
+        try:
+            with open(stamp_file, 'r') as file:
+                if file.read() == key and os.path.exists(output):
+                    return 'unchanged'
+        except OSError:
+            pass
+
+    if os.path.lexists(output):
+        # Outputs of older versions may be hard links to the source, never write through them.
+        os.remove(output)
+    if b'`' in data:
+        # Preprocess the Verilog file using iverilog
+        subprocess.run(['iverilog', '-E'] + [f'-D{macro}' for macro in macros] + [input_file, '-o', output], check=True)
+        status = 'preprocessed'
+    else:
+        replace_with_copy(input_file, output)
+        status = 'copied'
+    with open(stamp_file, 'w') as file:
+        file.write(key)
+    return status
+
+def flatten_verilog_files(file_pairs, macros, jobs):
+    """Flatten (input_file, output) pairs with at most jobs iverilog processes at a time and print the timings."""
+    timings = {'preprocessed': [], 'copied': [], 'unchanged': []}
+
+    def flatten_one(file_pair):
+        start = time.perf_counter()
+        status = flatten_verilog(file_pair[0], file_pair[1], macros)
+        timings[status].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # list() re-raises the first failure of iverilog
+        list(executor.map(flatten_one, file_pairs))
+    print(f"Flattened {len(file_pairs)} file(s) in {time.perf_counter() - start:.2f}s with {jobs} job(s):")
+    print(f"  {len(timings['preprocessed'])} preprocessed by iverilog ({sum(timings['preprocessed']):.2f}s)")
+    print(f"  {len(timings['copied'])} without directives, copied instead ({sum(timings['copied']):.2f}s)")
+    print(f"  {len(timings['unchanged'])} unchanged since the last run ({sum(timings['unchanged']):.2f}s)")
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a Verilog schematic diagram.")
+    parser.add_argument("-input_file", help="Path to the input Verilog file")
+    parser.add_argument("-output", help="Path to the output schematic file (without extension)")
+    parser.add_argument("-input_dir", help="Flatten every verilog file of this directory instead of a single file")
+    parser.add_argument("-output_dir", help="Directory of the <name>_flattened_verilog.v files when -input_dir is used")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="Number of iverilog processes run at the same time")
+    parser.add_argument("-macros", required=True, help="Please give the macros for the verilog file, if any.")
+
+    args = parser.parse_args()
+
+    macros = args.macros
+    macros = macros.split()
+    if args.input_dir and args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        file_pairs = [(input_file, os.path.join(args.output_dir, os.path.splitext(os.path.basename(input_file))[0] + '_flattened_verilog.v'))
+                      for input_file in design_files(args.input_dir)]
+        flatten_verilog_files(file_pairs, macros, args.jobs)
+    elif args.input_file and args.output:
+        flatten_verilog(args.input_file, args.output, macros)
+    else:
+        parser.error("either -input_file and -output or -input_dir and -output_dir are required")
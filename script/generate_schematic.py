@@ -1,459 +1,359 @@
-from pyverilog.vparser.parser import parse
-from pyverilog.vparser.ast import Node, InstanceList, Instance, PortArg, Wire, ModuleDef, Partselect, Decl
 from graphviz import Digraph
 import argparse
 import os
-import subprocess
 import re
+from design_tables import collect_design_tables
+from export_netlist import export_netlist, add_export_arguments, export_formats
+from module_index import ModuleIndex, default_index_file
+from netlist import Netlist
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, add_frontend_argument
+from profiling import Profiler, null_profiler
+from render_backend import render_with_backend, add_render_arguments, render_options
+from source_buffer import get_source_buffer
 
-node_name_mapping = {"input":{}, "wire":{"input":{}, "output":{}}, "output":{}}
-declared_variables = {}
 constant_pattern = re.compile(r"^\d+'[bBoOdDhH][0-9a-fA-F]+$")
 
-def grep_module_in_files(module_name):
-    """Find the file containing the given module name."""
-    design_folder = args.design_dir
-    try:
-        # Use grep to find the module in files
-        result = subprocess.run(
-            ["grep", "-rl", f"module {module_name}", design_folder],
-            capture_output=True, text=True, check=True
-        )
-        file_paths = result.stdout.strip().split('\n')
-        # Check if there are multiple definitions
-        if len(file_paths) > 1:
-            raise ValueError(
-                f"Error: Multiple definitions of module '{module_name}' found in files:\n" +
-                "\n".join(file_paths)
-            )
-        return file_paths[0] if file_paths else None
-    except subprocess.CalledProcessError:
-        # grep returns non-zero exit code if no match is found
-        return None
-
-def extract_ports_from_file(file_path, module_name):
-    ports = {}
-    with open(file_path, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith(('input', 'output', 'inout')):
-                parts = line.split('//')[0].strip()
-                parts = re.sub(r'[;,)]',' ',parts)
-                parts = re.sub(r'(\w)(\[)',r'\1 \2',parts)
-                parts = parts.split()
-                parts[0] = 'output' if (parts[0] == 'inout') else parts[0]
-                if parts[1].startswith('['):
-                    for port_name in parts[2:]:
-                        ports[port_name] = parts[0]
-                else:
-                    for port_name in parts[1:]:
-                        ports[port_name] = parts[0]
-
-    # NOT USING THE NEXT PART OF CODE AS PYVERILOG IS NOT GIVING PORT'S DIRECTION IN PORTLIST CLASS. 
-    # Parse the file using Pyverilog
-    # ast, _ = parse([file_path])
-    # ports = {}
-    # # Traverse the AST to find the module definition matching the module_name
-    # for description in ast.children():
-    #     for module in description.children():
-    #         if module.__class__.__name__ == "ModuleDef" and module.name == module_name:
-    #             # Extract ports for the specific module
-    #             print(f'module.portlist.ports = {module.portlist.ports}')
-    #             for port in module.portlist.ports:
-    #                 print(f'vars(port) = {vars(port)} and module_name = {module_name}')
-    #                 # print(f'port.first.__class__.__name__ = {port.first.__class__.__name__}')
-    #                 if hasattr(port, 'first'):
-    #                     port_name = port.first.name
-    #                     port_type = "input" if port.first.__class__.__name__ == "Inout" else port.first.__class__.__name__.lower()
-    #                     ports[port_name] = port_type
-
-    return ports
-
-def extract_always_block_code(filename, start_lineno):
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-    block_code = []
-    nested_count = 0
-    capturing = False
-    for i, line in enumerate(lines):
-        if i + 1 >= start_lineno:
-            capturing = True
-        if capturing:
-            block_code.append(line)
-            if 'begin' in line:
-                nested_count += 1
-            if 'end' in line:
-                nested_count -= 1
-                if nested_count == 0:
-                    break
-    return ''.join(block_code)
-
-def extract_assign_statement_code(filename, start_lineno):
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-    return lines[start_lineno - 1]
-
-def create_schematic_from_ast(ast):
+def truncate_code(code, max_lines=0, max_chars=0):
+    """Cut a statement text to max_lines lines and max_chars characters (0: no limit) and tell how many lines were left out."""
+    text = "".join(code.splitlines(keepends=True)[:max_lines]) if max_lines else code
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars]
+    if len(text) == len(code):
+        return code
+    hidden = len(code.splitlines()) - len(text.splitlines())
+    if not text.endswith("\n"):
+        text += " ...\n"
+    if hidden:
+        text += f"... {hidden} more line(s)\n"
+    return text
+
+def statement_label(statement, source_buffer, label_mode='code', max_lines=0, max_chars=0):
+    """
+    Return the label of an always/assign/wire node, its last source line and whether the code was left out of the label.
+
+    'code' shows the source text cut to max_lines and max_chars, 'summary' only the
+    signals the statement drives and reads (not the literals), 'link' only its name
+    and source lines.
+    """
+    end_lineno = source_buffer.statement_end_lineno(statement.lineno) if statement.kind == 'always' else statement.lineno
+    if label_mode == 'code':
+        code = source_buffer.lines(statement.lineno, end_lineno)
+        label = truncate_code(code, max_lines, max_chars)
+        return (label.replace("\n", "\\l") if statement.kind == 'always' else label), end_lineno, label != code
+    lines = f"lines {statement.lineno}-{end_lineno}" if end_lineno != statement.lineno else f"line {statement.lineno}"
+    if label_mode == 'link':
+        return f"{statement.name}\\n{lines}", end_lineno, True
+    summary = (f"{statement.name} ({lines})\n"
+               f"out: {', '.join(sorted(map(str, statement.outputs)))}\n"
+               f"in: {', '.join(sorted(signal for signal in map(str, statement.inputs) if not signal[:1].isdigit()))}\n")
+    return truncate_code(summary, max_lines, max_chars).replace("\n", "\\l"), end_lineno, True
+
+def create_schematic_from_ast(ast, input_file, module_index, **options):
+    # Collect declarations, ports, statements and instances in a single traversal of the AST
+    return create_schematic_from_tables(collect_design_tables(ast), input_file, module_index, **options)
+
+def create_schematic_from_tables(tables, input_file, module_index, fanout_threshold=0, fanout_mode='hub', module_urls=None,
+                                 label_mode='code', label_max_lines=0, label_max_chars=0, source_url='', profiler=null_profiler):
+    """
+    Build the Graphviz schematic of one parsed file.
+
+    The labels of always blocks and assigns follow label_mode (see statement_label).
+    A label without all of its code gets a tooltip with its source lines, and
+    source_url (eg, 'vscode://file/{file}:{first}') links every statement node to
+    its source range.
+
+    Nets read by more than fanout_threshold nodes (0 disables it) are collapsed:
+    with fanout_mode 'hub' the drivers go to one hub node and every reader gets a
+    short labelled stub, with 'omit' the reader edges are left out and only the
+    annotated hub node is drawn. Instances of the modules in module_urls link to
+    the given URL (the schematic of that module).
+    """
+    # All the state of one schematic is local, so several modules can be processed in one process (or thread)
+    netlist = Netlist()
+    source_buffer = get_source_buffer(input_file)
+    declared_variables = tables.declarations
+    # instance port node -> instance name, used to name the port arrows of instance connections
+    instance_of_port = {}
+
     # Initialize a Graphviz Digraph for the schematic
     schematic = Digraph(format='svg')
     # schematic.attr(rankdir='LR', nodesep="1.0", ranksep="1.0", splines="ortho")  # Left-to-right layout, orthogonal edges
     # schematic.attr(rankdir='LR', nodesep="1.0", ranksep="1.0")
     schematic.attr(rankdir='LR')  # Left-to-right layout, orthogonal edges
 
-    # list all wire and inputs in a dictionary 
-    def all_decalared_signals(node):
-        if node.__class__.__name__ in ('Input', 'Inout', 'Output', 'Wire', 'Reg'):
-            port_name = node.name
-            if node.width == None:
-                declared_variables[port_name] = 0
-            else:
-                declared_variables[port_name] = {}
-                declared_variables[port_name]['msb'] = node.width.msb
-                declared_variables[port_name]['lsb'] = node.width.lsb
-        if hasattr(node, 'children'):
-            for child in node.children():
-                all_decalared_signals(child)
-
-    all_decalared_signals(ast)
-
     # Cluster for input ports
     with schematic.subgraph(name="cluster_inputs") as inputs_cluster:
         inputs_cluster.attr(style="solid", color="blue", label="Inputs", fontsize="12")
         
-        # Traverse the AST to extract input ports
-        def add_input_ports(node):
-            if (node.__class__.__name__ == 'Input'):
-                port_name = node.name
-                node_name = "input_" + str(node.name)
-                inputs_cluster.node(node_name, label=str(port_name), shape="box", style="rounded,filled", color="lightgrey")
-                node_name_mapping["input"][port_name] = node_name
-
-            if hasattr(node, 'children'):
-                for child in node.children():
-                    add_input_ports(child)
-
-        # Start traversing from the root node to populate inputs cluster
-        add_input_ports(ast)
+        for port_name in tables.input_ports:
+            node_name = "input_" + str(port_name)
+            inputs_cluster.node(node_name, label=str(port_name), shape="box", style="rounded,filled", color="lightgrey")
+            netlist.add_input_port(port_name)
 
     with schematic.subgraph(name="cluster_outputs") as outputs_cluster:
         outputs_cluster.attr(style="solid", color="blue", label="Outputs", fontsize="12")
     
-        # Traverse the AST to extract input ports
-        def add_output_ports(node):
-            if (node.__class__.__name__ == 'Output'):
-                port_name = node.name
-                node_name = "output_" + str(node.name)
-                outputs_cluster.node(node_name, label=str(port_name), shape="box", style="rounded,filled", color="lightgrey")
-                node_name_mapping["output"][port_name] = node_name
-
-            if hasattr(node, 'children'):
-                for child in node.children():
-                    add_output_ports(child)
-
-        # Start traversing from the root node to populate inputs cluster
-        add_output_ports(ast)
-
-    def l_value_extractor(node):
-        # print(f'vars in L value = {vars(node)}')
-        # print(f'node in l_value_extractor = {node}')
-        if hasattr(node, 'name'):
-            return str(node.name)
-        if hasattr(node, 'children'):
-            for child in node.children():
-                result = l_value_extractor(child)
-                if result is not None:  # Return as soon as a non-None result is found
-                    return result
-
-    def signal_extractor(node, signal_dict=None):
-        if signal_dict is None:
-            signal_dict = {"input": set(), "output": set()}
-
-        # Check for signal direction based on node attributes
-        if (node.__class__.__name__ == 'Lvalue'):
-            # print(f'if vars(node) = {vars(node)}')
-            signal_name = l_value_extractor(node)
-            signal_dict["output"].add(signal_name)
-        elif hasattr(node, 'name'):
-            # print(f'name else if vars(node) = {vars(node)}')
-            signal_dict["input"].add(node.name)
-        elif hasattr(node, 'value'):
-            # print(f'var else if vars(node) = {vars(node)}')
-            signal_dict["input"].add(node.value)
+        for port_name in tables.output_ports:
+            node_name = "output_" + str(port_name)
+            outputs_cluster.node(node_name, label=str(port_name), shape="box", style="rounded,filled", color="lightgrey")
+            netlist.add_output_port(port_name)
+
+    def add_always_assign_wire_statements_to_schematic(statement):
+        with profiler.stage('source_text'):
+            statement_code, end_lineno, shortened = statement_label(statement, source_buffer, label_mode, label_max_lines, label_max_chars)
+        statement_node_name = statement.name
+        source_attributes = {}
+        if shortened:
+            source_attributes['tooltip'] = f"{os.path.basename(input_file)} lines {statement.lineno}-{end_lineno}"
+        if source_url:
+            source_attributes['URL'] = source_url.format(file=os.path.abspath(input_file), first=statement.lineno, last=end_lineno)
+        # Add the Always block or assign statement as a node
+        schematic.node(statement_node_name, label=statement_code, shape="box", style="rounded,filled", color="lightblue", fontsize="10", fontname="Courier", **source_attributes)
+        for input_signal in statement.inputs:
+            if (bool(constant_pattern.match(input_signal.strip()))) and (len(statement.inputs) == 1):
+                node_name_internal = statement_node_name + "_" + input_signal
+                schematic.node(node_name_internal, label=f"{input_signal}", shape="box", style="rounded,filled", color="lightgrey")
+                schematic.edge(f'{node_name_internal}:e', f'{statement_node_name}:w', label=f"{input_signal}", arrowhead="vee", color="black")
+            elif not input_signal[:1].isdigit():
+                # Literals such as the index of din[30] are not nets, nothing drives them
+                netlist.add_reader(input_signal, statement_node_name)
+        for output_signal in statement.outputs:
+            netlist.add_driver(output_signal, statement_node_name)
+
+    for statement in tables.statements:
+        add_always_assign_wire_statements_to_schematic(statement)
+
+    # Add module instances and their port connections
+    def add_instance_to_schematic(instance):
+        instance_name = instance.name
+        module_name = instance.module
+        instance_label = f"{module_name}\\n({instance_name})"
+        cluster_name = f"cluster_{instance_name}"
+        ports_position = {}
+        with profiler.stage('module_lookup'):
+            module_definition = module_index.lookup(module_name)
+        if module_definition != None:
+            # if the module is defined in the design then take input output signal information from the index
+            ports_position = dict(module_definition['ports'])
         else:
-            pass
-            # print(f' else vars(node) = {vars(node)}')
-
-        # Recursively process child nodes
-        if hasattr(node, 'children'):
-            for child in node.children():
-                signal_extractor(child, signal_dict)
-
-        return signal_dict
-
-    def add_always_assign_wire_statements_to_schematic(node):
-        if node.__class__.__name__ in ('Always', 'Assign', 'Decl'):
-            if node.__class__.__name__ == 'Always':
-                statement_code = extract_always_block_code(args.input_file,node.lineno)
-                statement_code = statement_code.replace("\n", "\\l")
-                statement_node_name = f"always_{id(node)}"
-                signal_names = signal_extractor(node)
-                signal_names['input'] -= signal_names['output']
-            elif node.__class__.__name__ == 'Assign':
-                statement_code = extract_assign_statement_code(args.input_file,node.lineno)
-                statement_node_name = f"assign_{id(node)}"
-                signal_names = signal_extractor(node)
-                signal_names['input'] -= signal_names['output']
-            elif node.__class__.__name__ == 'Decl':
-                statement_code = extract_assign_statement_code(args.input_file,node.lineno)
-                signal_names = signal_extractor(node)
-                if (len(signal_names['output']) != 0):
-                    signal_names['input'] -= signal_names['output']
-                    statement_node_name = f"wire_{id(node)}"
-                else:
-                    return
-            # Add the Always block or assign statement as a node
-            schematic.node(statement_node_name, label=statement_code, shape="box", style="rounded,filled", color="lightblue", fontsize="10", fontname="Courier")
-            # print(f'signal_names = {signal_names}')
-            for input_signal in signal_names["input"]:
-                # print(f'input_signal = {input_signal} and bool(constant_pattern.match(input_signal)) = {bool(constant_pattern.match(input_signal))}')
-                if (bool(constant_pattern.match(input_signal.strip()))) and (len(signal_names["input"]) == 1):
-                    # print(f'input_signal = {input_signal}')
-                    node_name_internal = statement_node_name + "_" + input_signal
-                    schematic.node(node_name_internal, label=f"{input_signal}", shape="box", style="rounded,filled", color="lightgrey")
-                    schematic.edge(f'{node_name_internal}:e', f'{statement_node_name}:w', label=f"{input_signal}", arrowhead="vee", color="black")
-                else:
-                    if input_signal in node_name_mapping["wire"]["input"] and not isinstance(node_name_mapping["wire"]["input"][input_signal], list):
-                        node_name_mapping["wire"]["input"][input_signal] = [node_name_mapping["wire"]["input"][input_signal]]
-                        node_name_mapping["wire"]["input"][input_signal].append(statement_node_name)
-                    elif input_signal in node_name_mapping["wire"]["input"] and isinstance(node_name_mapping["wire"]["input"][input_signal], list):
-                        node_name_mapping["wire"]["input"][input_signal].append(statement_node_name)
-                    else:
-                        node_name_mapping["wire"]["input"][input_signal] = statement_node_name
-                    if input_signal in node_name_mapping["input"]:
-                        node_name_internal = "input_" + statement_node_name + "_" + input_signal
-                        schematic.node(node_name_internal, label=f"{input_signal}", shape="rarrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
-                        schematic.edge(f'{node_name_internal}:e', f'{statement_node_name}:w', label=f"{input_signal}", arrowhead="vee", color="black")
-                    elif input_signal in node_name_mapping["wire"]["output"]:
-                        if isinstance(node_name_mapping["wire"]["output"][input_signal], list):
-                            for target_node in node_name_mapping["wire"]["output"][input_signal]:
-                                schematic.edge(f'{target_node}:e', f'{statement_node_name}:w', label=f"{input_signal}", arrowhead="vee", color="black")
-                        else:
-                            schematic.edge(f'{node_name_mapping["wire"]["output"][input_signal]}:e', f'{statement_node_name}:w', label=f"{input_signal}", arrowhead="vee", color="black")
-
-            for output_signal in signal_names["output"]:
-                if output_signal in node_name_mapping["wire"]["output"] and not isinstance(node_name_mapping["wire"]["output"][output_signal], list):
-                    node_name_mapping["wire"]["output"][output_signal] = [node_name_mapping["wire"]["output"][output_signal]]
-                    node_name_mapping["wire"]["output"][output_signal].append(statement_node_name)
-                elif output_signal in node_name_mapping["wire"]["output"] and isinstance(node_name_mapping["wire"]["output"][output_signal], list):
-                    node_name_mapping["wire"]["output"][output_signal].append(statement_node_name)
+            # guess the direction of every port from what is already known about the connected net
+            for port in instance.ports:
+                internal_port = port.portname
+                external_wire = port.external_wire
+
+                if (external_wire == "None"):
+                    ports_position[internal_port] = 'middle'
+                elif bool(constant_pattern.match(external_wire)):
+                    ports_position[internal_port] = 'input'
+                elif netlist.is_output_port(external_wire):
+                    ports_position[internal_port] = 'output'
+                elif netlist.is_input_port(external_wire):
+                    ports_position[internal_port] = 'input'
+                elif netlist.is_read(external_wire) and not netlist.is_driven(external_wire):
+                    ports_position[internal_port] = 'output'
+                elif netlist.is_driven(external_wire) and not netlist.is_read(external_wire):
+                    ports_position[internal_port] = 'input'
                 else:
-                    node_name_mapping["wire"]["output"][output_signal] = statement_node_name
-                if output_signal in node_name_mapping["wire"]["input"]:
-                    if isinstance(node_name_mapping["wire"]["input"][output_signal], list):
-                        for target_node in node_name_mapping["wire"]["input"][output_signal]:
-                            schematic.edge(f'{statement_node_name}:e', f'{target_node}:w', label=f"{output_signal}", arrowhead="vee", color="black")
+                    ports_position[internal_port] = 'output'
+
+        # Add a node for the instance
+        with schematic.subgraph(name=cluster_name) as instance_cluster:
+            instance_cluster.attr(style="solid", color="blue", label=instance_label, fontsize="12")
+            if module_urls and module_name in module_urls:
+                # drill down from the instance to the schematic of its module
+                instance_cluster.attr(URL=module_urls[module_name], tooltip=f"open {module_name}")
+            temp_input = None
+            temp_middle = None
+            temp_output = None
+            for port_name in ports_position:
+                node_name = str(instance_label) + str(port_name)
+                if (ports_position[port_name] == 'input'):
+                    temp_input = node_name
+                    # print(f'port_name = {port_name} and ports_position[port_name] = {ports_position[port_name]}')
+                    with instance_cluster.subgraph(name="cluster_inputs") as input_group:
+                        input_group.attr(style="invis")  # Group inputs
+                        input_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
+                elif (ports_position[port_name] == 'middle'):
+                    temp_middle = node_name
+                    with instance_cluster.subgraph(name="cluster_middle") as middle_group:
+                        middle_group.attr(style="invis")  # Group middle
+                        middle_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
+                elif (ports_position[port_name] == 'output'):
+                    temp_output = node_name
+                    with instance_cluster.subgraph(name="cluster_outputs") as output_group:
+                        output_group.attr(style="invis")  # Group outputs
+                        output_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
+            # print(f'temp_middle = {temp_middle}')
+            if (temp_middle != None) and (temp_input != None) and (temp_output != None):
+                # print(f'in the if statement: temp_input = {temp_input}, temp_middle = {temp_middle} and temp_output = {temp_output}')
+                schematic.edge(temp_input, temp_middle, style='invis')
+                schematic.edge(temp_middle, temp_output, style='invis')
+            elif (temp_output != None) and (temp_input != None):
+                # print(f'in the else statement: temp_input = {temp_input}, temp_middle = {temp_middle} and temp_output = {temp_output}')
+                schematic.edge(temp_input, temp_output, style='invis')
+                # schematic.edge(temp_input, temp_output, style='invis')
+            for port in instance.ports:
+                internal_port = port.portname
+                node_name = str(instance_label) + str(internal_port)
+                external_wire = port.external_wire
+                direction = ports_position.get(internal_port)
+
+                # a part select that differs from the declaration goes through a bus node
+                declared = declared_variables.get(external_wire)
+                if (port.msb != None) and (not isinstance(declared, dict) or (port.msb != declared['msb']) or (port.lsb != declared['lsb'])):
+                    node_name_bus = external_wire + '_bus'
+                    instance_cluster.node(node_name_bus, shape='box', style="rounded,filled", color='black')
+                    if direction == 'input':
+                        schematic.edge(f'{node_name_bus}:e', f'{node_name}:w', arrowhead="vee", color="black")
+                        netlist.add_reader(external_wire, node_name_bus)
                     else:
-                        schematic.edge(f'{statement_node_name}:e', f'{node_name_mapping["wire"]["input"][output_signal]}:w', label=f"{output_signal}", arrowhead="vee", color="black")
-                elif output_signal in node_name_mapping["output"]:
-                    node_name_internal = "output_" + statement_node_name + "_" + output_signal
-                    schematic.node(node_name_internal, label=f"{output_signal}", shape="larrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
-                    schematic.edge(f'{statement_node_name}:e', f'{node_name_internal}:w', label=f"{output_signal}", arrowhead="vee", color="black")
-
-        # Recursively traverse child nodes
-        if hasattr(node, 'children'):
-            for child in node.children():
-                add_always_assign_wire_statements_to_schematic(child)
-
-    add_always_assign_wire_statements_to_schematic(ast)
-
-    # Traverse the AST to find module instances and their port connections
-    def add_instance_to_schematic(node):
-        if isinstance(node, InstanceList):
-            inst = node.instances[0]
-            instance_name = inst.name
-            module_name = inst.module
-            instance_label = f"{module_name}\\n({instance_name})"
-            cluster_name = f"cluster_{instance_name}"
-            ports_position = {}
-            file_with_module = grep_module_in_files(module_name)
-            # print(f'file_with_module = {file_with_module}')
-            if file_with_module != None:
-                # if file exists then take input output signal information from the file
-                ports_position = extract_ports_from_file(file_with_module, module_name)
-            else:
-                # print(f'instance_name = {instance_name} and module_name = {module_name}')
-                for port in inst.portlist:
-                    internal_port = port.portname
-                    if hasattr(port.argname, "var"):
-                        external_wire = str(port.argname.var)
-                    elif hasattr(port.argname, "name"):
-                        external_wire = str(port.argname.name)
-                    else:
-                        external_wire = str(port.argname)
-
-                    if (external_wire == "None"):
-                        ports_position[internal_port] = 'middle'
-                    elif bool(constant_pattern.match(external_wire)):
-                        ports_position[internal_port] = 'input'
-                    elif external_wire in node_name_mapping["output"]:
-                        ports_position[internal_port] = 'output'
-                    elif external_wire in node_name_mapping["input"]:
-                        ports_position[internal_port] = 'input'
-                    elif (external_wire in node_name_mapping['wire']["input"]) and (not(external_wire in node_name_mapping['wire']["output"])):
-                        ports_position[internal_port] = 'output'
-                    elif (external_wire in node_name_mapping['wire']["output"]) and (not(external_wire in node_name_mapping['wire']["input"])):
-                        ports_position[internal_port] = 'input'
-                    else:
-                        ports_position[internal_port] = 'output'
-            
-            # print(f'ports_position = {ports_position}')
-
-            # Add a node for the instance
-            with schematic.subgraph(name=cluster_name) as instance_cluster:
-                instance_cluster.attr(style="solid", color="blue", label=instance_label, fontsize="12")
-                temp_input = None
-                temp_middle = None
-                temp_output = None
-                for port_name in ports_position:
-                    node_name = str(instance_label) + str(port_name)
-                    if (ports_position[port_name] == 'input'):
-                        temp_input = node_name
-                        # print(f'port_name = {port_name} and ports_position[port_name] = {ports_position[port_name]}')
-                        with instance_cluster.subgraph(name="cluster_inputs") as input_group:
-                            input_group.attr(style="invis")  # Group inputs
-                            input_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
-                    elif (ports_position[port_name] == 'middle'):
-                        temp_middle = node_name
-                        with instance_cluster.subgraph(name="cluster_middle") as middle_group:
-                            middle_group.attr(style="invis")  # Group middle
-                            middle_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
-                    elif (ports_position[port_name] == 'output'):
-                        temp_output = node_name
-                        with instance_cluster.subgraph(name="cluster_outputs") as output_group:
-                            output_group.attr(style="invis")  # Group outputs
-                            output_group.node(node_name, label=port_name, shape='box', style="rounded,filled", color='lightgrey')
-                # print(f'temp_middle = {temp_middle}')
-                if (temp_middle != None) and (temp_input != None) and (temp_output != None):
-                    # print(f'in the if statement: temp_input = {temp_input}, temp_middle = {temp_middle} and temp_output = {temp_output}')
-                    schematic.edge(temp_input, temp_middle, style='invis')
-                    schematic.edge(temp_middle, temp_output, style='invis')
-                elif (temp_output != None) and (temp_input != None):
-                    # print(f'in the else statement: temp_input = {temp_input}, temp_middle = {temp_middle} and temp_output = {temp_output}')
-                    schematic.edge(temp_input, temp_output, style='invis')
-                    # schematic.edge(temp_input, temp_output, style='invis')
-                temp_input = None
-                temp_middle = None
-                temp_output = None
-                for port in inst.portlist:
-                    internal_port = port.portname
-                    node_name = str(instance_label) + str(internal_port)
-                    # instance_cluster.node(node_name, label=internal_port, shape="box", style="rounded,filled", color="lightgrey")
-                    if hasattr(port.argname, "var"):
-                        external_wire = str(port.argname.var)
-                    elif hasattr(port.argname, "name"):
-                        external_wire = str(port.argname.name)
-                    else:
-                        external_wire = str(port.argname)
-
-                    
-                    # to determine if external wire has a width and it is not equal to decalaration statement.
-                    temp_msb = 0
-                    temp_lsb = 0
-                    dec_msb = 0
-                    dec_lsb = 0
-                    if (port.argname != None) and (hasattr(port.argname, "msb")):
-                        temp_msb = port.argname.msb
-                        temp_lsb = port.argname.lsb
-                        dec_msb = declared_variables[external_wire]['msb']
-                        dec_lsb = declared_variables[external_wire]['lsb']
-                    
-                    if (temp_lsb != dec_lsb) or (temp_msb != dec_msb):
-                        node_name_bus = external_wire + '_bus'
-                        instance_cluster.node(node_name_bus, shape='box', style="rounded,filled", color='black')
                         schematic.edge(f'{node_name}:e', f'{node_name_bus}:w', arrowhead="vee", color="black")
-                        node_name = node_name_bus
-                        node_name_mapping["wire"]["output"][external_wire] = node_name
-                        external_wire = internal_port + external_wire
-
-                    if bool(constant_pattern.match(external_wire.strip())):
-                        # print(f'input_signal = {input_signal}')
-                        # print(f'internal_port = {internal_port} external_wire = {external_wire}')
-                        node_name_internal = internal_port + "_" + external_wire + "_" + node_name
-                        schematic.node(node_name_internal, label=f"{external_wire}", shape="box", style="rounded,filled", color="lightgrey")
-                        schematic.edge(f'{node_name_internal}:e', f'{node_name}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                    else:
-                        if str(external_wire) in node_name_mapping["input"]:
-                            pass
-                            node_name_internal = "input_" + instance_name + "_" + external_wire
-                            schematic.node(node_name_internal, label=f"{external_wire}", shape="rarrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
-                            schematic.edge(f'{node_name_internal}:e', f'{node_name}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                        elif external_wire in node_name_mapping["wire"]["output"]:
-                            if isinstance(node_name_mapping["wire"]["output"][external_wire], list):
-                                for target_node in node_name_mapping["wire"]["output"][external_wire]:
-                                    pass
-                                    schematic.edge(f'{target_node}:e', f'{node_name}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                            else:
-                                pass
-                                schematic.edge(f'{node_name_mapping["wire"]["output"][external_wire]}:e', f'{node_name}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                        elif external_wire in node_name_mapping["wire"]["input"]:
-                            if isinstance(node_name_mapping["wire"]["input"][external_wire], list):
-
-                                for target_node in node_name_mapping["wire"]["input"][external_wire]:
-                                    pass
-                                    schematic.edge(f'{node_name}:e', f'{target_node}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                            else:
-                                pass
-                                schematic.edge(f'{node_name}:e', f'{node_name_mapping["wire"]["input"][external_wire]}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                        elif external_wire in node_name_mapping["output"]:
-                            pass
-                            node_name_internal = "output_" + instance_name + "_" + external_wire
-                            schematic.node(node_name_internal, label=f"{external_wire}", shape="larrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
-                            schematic.edge(f'{node_name}:e', f'{node_name_internal}:w', label=f"{external_wire}", arrowhead="vee", color="black")
-                        # to put the wire names in node_name_mapping dictionary.
-                        # print(f'ports_position = {ports_position}')
-                        if (external_wire != 'None'):
-                            if (ports_position[internal_port] == 'input'):
-                                if external_wire in node_name_mapping["wire"]["input"] and not isinstance(node_name_mapping["wire"]["input"][external_wire], list):
-                                    node_name_mapping["wire"]["input"][external_wire] = [node_name_mapping["wire"]["input"][external_wire]]
-                                    node_name_mapping["wire"]["input"][external_wire].append(node_name)
-                                elif external_wire in node_name_mapping["wire"]["input"] and isinstance(node_name_mapping["wire"]["input"][external_wire], list):
-                                    node_name_mapping["wire"]["input"][external_wire].append(node_name)
-                                else:
-                                    node_name_mapping["wire"]["input"][external_wire] = node_name
-
-                            elif (ports_position[internal_port] == 'output'):
-                                if external_wire in node_name_mapping["wire"]["output"] and not isinstance(node_name_mapping["wire"]["output"][external_wire], list):
-                                    node_name_mapping["wire"]["output"][external_wire] = [node_name_mapping["wire"]["output"][external_wire]]
-                                    node_name_mapping["wire"]["output"][external_wire].append(node_name)
-                                elif external_wire in node_name_mapping["wire"]["output"] and isinstance(node_name_mapping["wire"]["output"][external_wire], list):
-                                    node_name_mapping["wire"]["output"][external_wire].append(node_name)
-                                else:
-                                    node_name_mapping["wire"]["output"][external_wire] = node_name
-  
-        # Recursively traverse child nodes
-        if hasattr(node, 'children'):
-            for child in node.children():
-                add_instance_to_schematic(child)
-
-    add_instance_to_schematic(ast)
-
-    # Save the schematic
-    filename_schematic = args.output
-    schematic.render(filename=filename_schematic, format='svg', cleanup=True)
-    print(f"Schematic saved as '{filename_schematic}.svg'")
+                        netlist.add_driver(external_wire, node_name_bus)
+                elif bool(constant_pattern.match(external_wire.strip())):
+                    node_name_internal = internal_port + "_" + external_wire + "_" + node_name
+                    schematic.node(node_name_internal, label=f"{external_wire}", shape="box", style="rounded,filled", color="lightgrey")
+                    schematic.edge(f'{node_name_internal}:e', f'{node_name}:w', label=f"{external_wire}", arrowhead="vee", color="black")
+                elif (external_wire != 'None'):
+                    instance_of_port[node_name] = instance_name
+                    if direction == 'input':
+                        netlist.add_reader(external_wire, node_name)
+                    elif direction == 'output':
+                        netlist.add_driver(external_wire, node_name)
+
+    for instance in tables.instances:
+        add_instance_to_schematic(instance)
+
+    # Every driver and reader is known now, draw the connections in one pass over the nets
+    collapsed_nets = []
+
+    def add_net_edges_to_schematic():
+        for net_name, drivers, readers in netlist.nets():
+            if fanout_threshold and len(readers) > fanout_threshold:
+                collapsed_nets.append((net_name, len(drivers), len(readers)))
+                add_high_fanout_net_to_schematic(net_name, drivers, readers)
+                continue
+            if netlist.is_input_port(net_name):
+                for reader in readers:
+                    node_name_internal = "input_" + instance_of_port.get(reader, reader) + "_" + net_name
+                    schematic.node(node_name_internal, label=f"{net_name}", shape="rarrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
+                    schematic.edge(f'{node_name_internal}:e', f'{reader}:w', label=f"{net_name}", arrowhead="vee", color="black")
+            for driver in drivers:
+                for reader in readers:
+                    schematic.edge(f'{driver}:e', f'{reader}:w', label=f"{net_name}", arrowhead="vee", color="black")
+            add_output_port_arrows(net_name, drivers)
+
+    def add_output_port_arrows(net_name, drivers):
+        if netlist.is_output_port(net_name):
+            for driver in drivers:
+                node_name_internal = "output_" + instance_of_port.get(driver, driver) + "_" + net_name
+                schematic.node(node_name_internal, label=f"{net_name}", shape="larrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
+                schematic.edge(f'{driver}:e', f'{node_name_internal}:w', label=f"{net_name}", arrowhead="vee", color="black")
+
+    def add_high_fanout_net_to_schematic(net_name, drivers, readers):
+        hub_node_name = "hub_" + net_name
+        if fanout_mode == 'omit':
+            hub_label = f"{net_name}\\n{len(readers)} readers not drawn"
+        else:
+            hub_label = f"{net_name}\\n{len(readers)} readers"
+        schematic.node(hub_node_name, label=hub_label, shape="box", style="bold,filled", color="orange", fontsize="10", fontname="Courier")
+        if netlist.is_input_port(net_name):
+            node_name_internal = "input_hub_" + net_name
+            schematic.node(node_name_internal, label=f"{net_name}", shape="rarrow", style="rounded,filled", color="lightgrey", fontsize="10", fontname="Courier")
+            schematic.edge(f'{node_name_internal}:e', f'{hub_node_name}:w', label=f"{net_name}", arrowhead="vee", color="black")
+        for driver in drivers:
+            schematic.edge(f'{driver}:e', f'{hub_node_name}:w', label=f"{net_name}", arrowhead="vee", color="black")
+        if fanout_mode != 'omit':
+            # a short stub next to every reader instead of an edge from the hub across the whole graph
+            for reader in readers:
+                node_name_internal = "stub_" + instance_of_port.get(reader, reader) + "_" + net_name
+                schematic.node(node_name_internal, label=f"{net_name}", shape="cds", style="filled", color="orange", fontsize="10", fontname="Courier")
+                schematic.edge(f'{node_name_internal}:e', f'{reader}:w', arrowhead="vee", color="orange")
+        add_output_port_arrows(net_name, drivers)
+
+    with profiler.stage('edges'):
+        add_net_edges_to_schematic()
+    if collapsed_nets:
+        print(f"Collapsed {len(collapsed_nets)} net(s) with more than {fanout_threshold} readers ({fanout_mode}):")
+        for net_name, driver_count, reader_count in sorted(collapsed_nets, key=lambda net: -net[2]):
+            print(f"  {net_name}: {driver_count} driver(s), {reader_count} reader(s)")
+
+    return schematic
+
+def render_schematic(schematic, filename_schematic, engine='dot', fallback_engine='sfdp', layout_timeout=0, dot_only=False,
+                     partitioned=False, layout_jobs=None, record_timings=False):
+    # Save the schematic, or only its dot source when the layout is left for later
+    used_engine = render_with_backend(schematic, filename_schematic, engine, fallback_engine, layout_timeout, dot_only, partitioned, layout_jobs,
+                                      record_timings)
+    if dot_only:
+        print(f"Dot source saved as '{filename_schematic}.dot'")
+    else:
+        print(f"Schematic saved as '{filename_schematic}.svg' ({used_engine})")
+
+def add_schematic_arguments(parser):
+    """Command line options of the schematic itself, shared by every script that builds schematics."""
+    parser.add_argument("-fanout_threshold", type=int, default=0, help="Collapse nets read by more nodes than this (default: 0, never)")
+    parser.add_argument("-fanout_mode", choices=("hub", "omit"), default="hub", help="Draw collapsed nets as a hub with a stub per reader, or omit the reader edges")
+    parser.add_argument("-label_mode", choices=("code", "summary", "link"), default="code",
+                        help="Label always blocks and assigns with their code, the signals they drive and read, or only their name and lines")
+    parser.add_argument("-label_max_lines", type=int, default=0, help="Cut the labels to this many lines (default: 0, no limit)")
+    parser.add_argument("-label_max_chars", type=int, default=0, help="Cut the labels to this many characters (default: 0, no limit)")
+    parser.add_argument("-source_url", default="", help="Link every statement to its source, {file}, {first} and {last} are replaced, eg, 'vscode://file/{file}:{first}'")
+
+def schematic_options(args):
+    return {"fanout_threshold": args.fanout_threshold, "fanout_mode": args.fanout_mode, "label_mode": args.label_mode,
+            "label_max_lines": args.label_max_lines, "label_max_chars": args.label_max_chars, "source_url": args.source_url}
+
+def generate_schematic(input_file, output, module_index, parse_cache, macros=(), profiler=null_profiler, export=(), render=True, render_options=None, **options):
+    """
+    Parse (or load from the cache) one verilog file and render its schematic to <output>.svg.
+
+    export lists the netlist formats ('jsonl', 'binary') written next to the
+    schematic. Without render only the netlist is written and dot is never run.
+    render_options are passed to render_schematic (layout engine, timeout, fallback).
+    """
+    with profiler.stage('parse'):
+        tables = parse_cache.load_design_tables(input_file, macros)
+    if export:
+        with profiler.stage('export'):
+            for filename in export_netlist(tables, input_file, module_index, output, export):
+                print(f"Netlist saved as '{filename}'")
+    if not render:
+        return
+    with profiler.stage('build'):
+        schematic = create_schematic_from_tables(tables, input_file, module_index, profiler=profiler, **options)
+    profiler.set_graph(schematic)
+    with profiler.stage('render'):
+        render_schematic(schematic, output, **(render_options or {}))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate a Verilog schematic diagram.")
     parser.add_argument("-input_file", required=True, help="Path to the input Verilog file")
     parser.add_argument("-output", required=True, help="Path to the output schematic file (without extension)")
     parser.add_argument("-design_dir", required=True, help="Path to all the verilog ")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <cache_dir>/module_index/<hash of design_dir>.json)")
+    parser.add_argument("-macros", default="", help="Macros used to preprocess the verilog file, if any.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    add_frontend_argument(parser)
+    add_schematic_arguments(parser)
+    parser.add_argument("-profile", "--profile", action="store_true", help="Save the time and memory of every stage to <output>.profile.json and print a summary")
+    add_export_arguments(parser)
+    parser.add_argument("-no_render", action="store_true", help="Do not build and render the schematic, only export the netlist")
+    add_render_arguments(parser)
 
     args = parser.parse_args()
-
-    # Parse the Verilog file
-    ast, _ = parse([args.input_file])
-
-    # Generate schematic from AST
-    create_schematic_from_ast(ast)
-    # print(f'node_name_mapping = {node_name_mapping}')
-    # print(f'declared_variables = {declared_variables}')
+    profiler = Profiler(os.path.basename(args.input_file)) if args.profile else null_profiler
+
+    # Load the module definitions of the design, rescanning only files changed since the last run
+    with profiler.stage('module_index'):
+        module_index = ModuleIndex.load(args.design_dir, args.module_index or default_index_file(args.design_dir, args.cache_dir))
+        module_index.save()
+
+    # Parse the Verilog file, or reuse the tables extracted from identical content in an earlier run
+    parse_cache = ParseCache(args.cache_dir, frontend=args.frontend)
+    generate_schematic(args.input_file, args.output, module_index, parse_cache, args.macros.split(), profiler,
+                       export_formats(args.export) if args.export else (), not args.no_render, render_options(args), **schematic_options(args))
+    parse_cache.report()
+    if args.profile:
+        profiler.save(args.output + '.profile.json')
+        profiler.print_summary()
+        profiler.close()
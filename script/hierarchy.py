@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from graphviz import Digraph
+import generate_schematic
+from batch import render_flattened_file, run_in_pool, print_summary
+from generate_schematic import add_schematic_arguments, schematic_options
+from module_index import ModuleIndex
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, add_frontend_argument, source_version
+from render_backend import add_render_arguments, render_options, render_with_backend
+
+
+def page_name(input_file):
+    return os.path.splitext(os.path.basename(input_file))[0] + '_schematic'
+
+
+def build_hierarchy(module_index, parse_cache, macros):
+    """
+    Return {file: {'modules': [names], 'instances': {module: count}}} for every file of the index.
+
+    The instances come from the design tables of every file, which are taken from
+    the parse cache when the file did not change.
+    """
+    hierarchy = {}
+    for input_file, entry in module_index.files.items():
+        tables = parse_cache.load_design_tables(input_file, macros)
+        instances = {}
+        for instance in tables.instances:
+            instances[instance.module] = instances.get(instance.module, 0) + 1
+        hierarchy[input_file] = {'modules': [module['name'] for module in entry['modules']], 'instances': instances}
+    return hierarchy
+
+
+def page_key(input_file, module_index, hierarchy, module_urls, macros, options):
+    """
+    Hash of everything a module page is drawn from: its file, the ports of the
+    modules it instantiates, the pages they link to and the schematic options.
+    """
+    digest = hashlib.sha256()
+    digest.update(module_index.files[input_file]['sha1'].encode())
+    for module_name in sorted(hierarchy[input_file]['instances']):
+        digest.update(json.dumps([module_name, module_index.unique_ports(module_name), module_urls.get(module_name)]).encode())
+    digest.update(json.dumps([sorted(macros), options, source_version(generate_schematic)], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def create_index(hierarchy, module_urls, rendered):
+    """Graph of the modules of the design, every module links to its page and every edge is an instantiation."""
+    index = Digraph('hierarchy', format='svg')
+    index.attr(rankdir='LR')
+    instantiated = {module_name for entry in hierarchy.values() for module_name in entry['instances']}
+    defined = set()
+    for input_file, entry in hierarchy.items():
+        for module_name in entry['modules']:
+            defined.add(module_name)
+            color = 'lightblue' if os.path.basename(module_urls[module_name]) in rendered else 'lightgrey'
+            index.node(module_name, label=f"{module_name}\\n{os.path.basename(input_file)}", shape='box', style='rounded,filled',
+                       color=color, penwidth='1' if module_name in instantiated else '3', URL=module_urls[module_name])
+    for input_file, entry in hierarchy.items():
+        for module_name in entry['modules']:
+            for child, count in sorted(entry['instances'].items()):
+                if child not in defined:
+                    # Library cells and other modules defined outside the design have no page
+                    defined.add(child)
+                    index.node(child, shape='box', style='dashed', color='grey')
+                index.edge(module_name, child, label=str(count) if count > 1 else '')
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw a module hierarchy index of a whole design and one linked schematic per file, rendering only what changed.")
+    parser.add_argument("-input_dir", required=True, help="Directory of the (flattened) verilog files of the design")
+    parser.add_argument("-output_dir", default="output/hierarchy", help="Directory of the module pages, the index and the render state")
+    parser.add_argument("-macros", default="", help="Macros used to preprocess the verilog files, if any.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    parser.add_argument("-modules", nargs="+", default=[], help="Render the pages of these modules even if they did not change")
+    parser.add_argument("-lazy", action="store_true", help="Render only the pages of the -modules, changed pages are left for later")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="Number of worker processes (default: number of cores)")
+    add_schematic_arguments(parser)
+    add_frontend_argument(parser)
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    macros = args.macros.split()
+    os.makedirs(args.output_dir, exist_ok=True)
+    module_index_file = os.path.join(args.output_dir, 'module_index.json')
+    module_index = ModuleIndex.load(args.input_dir, module_index_file)
+    parse_cache = ParseCache(args.cache_dir, frontend=args.frontend)
+    hierarchy = build_hierarchy(module_index, parse_cache, macros)
+    parse_cache.report()
+
+    # Every module links to the page of the file defining it, the pages sit next to each other (their .dot source with -dot_only)
+    page_extension = '.dot' if args.dot_only else '.svg'
+    module_urls = {module_name: page_name(input_file) + page_extension for input_file, entry in hierarchy.items() for module_name in entry['modules']}
+    unknown = [module_name for module_name in args.modules if module_name not in module_urls]
+    if unknown:
+        parser.error(f"modules not defined in '{args.input_dir}': {' '.join(unknown)}")
+    requested = {module_index.modules[module_name][0][0] for module_name in args.modules}
+
+    state_file = os.path.join(args.output_dir, 'hierarchy.json')
+    try:
+        with open(state_file, 'r') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        state = {}
+    options = schematic_options(args)
+    # Recording the layout times does not change the pages
+    page_options = dict(options, frontend=args.frontend, **{name: value for name, value in render_options(args).items() if name != 'record_timings'})
+    keys = {input_file: page_key(input_file, module_index, hierarchy, module_urls, macros, page_options) for input_file in hierarchy}
+    changed = {input_file for input_file, key in keys.items()
+               if state.get(input_file) != key or not os.path.exists(os.path.join(args.output_dir, page_name(input_file) + page_extension))}
+    to_render = requested if args.lazy else requested | changed
+
+    task_args = [(input_file, os.path.join(args.output_dir, page_name(input_file))) for input_file in sorted(to_render)]
+    results = run_in_pool(render_flattened_file, task_args, args.input_dir, module_index_file, args.cache_dir, args.jobs,
+                          dict(options, module_urls=module_urls), frontend=args.frontend,
+                          render_options=render_options(args)) if task_args else []
+    failed = {result['file'] for result in results if result['error']}
+    for input_file in to_render - failed:
+        state[input_file] = keys[input_file]
+    for input_file in set(state) - set(keys):
+        del state[input_file]
+    with open(state_file, 'w') as file:
+        json.dump(state, file, indent=2)
+
+    rendered = {os.path.basename(page) for page in os.listdir(args.output_dir) if page.endswith('_schematic' + page_extension)}
+    # The index goes through the same engines as the pages, it has no clusters to lay out on their own
+    render_with_backend(create_index(hierarchy, module_urls, rendered), os.path.join(args.output_dir, 'index'),
+                        **dict(render_options(args), partitioned=False))
+    print_summary(results, time.perf_counter() - start, args.jobs)
+    print(f"{len(module_urls)} module(s) in {len(hierarchy)} file(s): {len(changed)} page(s) out of date, "
+          f"{len(to_render)} rendered, {len(changed - to_render)} left for later")
+    print(f"Index saved as '{os.path.join(args.output_dir, 'index' + page_extension)}'")
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import generate_schematic
+from batch import render_flattened_file, run_in_pool, print_summary
+from flatten_verilog import flatten_verilog_files, replace_with_copy
+from generate_schematic import add_schematic_arguments, schematic_options
+from module_index import ModuleIndex, design_files
+from parse_cache import ParseCache, add_frontend_argument, source_version
+from render_backend import add_render_arguments, render_options
+
+
+def read_configurations(config_file, configs):
+    """
+    Return [(name, [macros])] from -config arguments and a file with one configuration per line.
+
+    A line is either "name: macro_1 macro_2" or just the macros, in which case the
+    name is made of the macros. Empty lines and lines starting with # are skipped.
+    """
+    lines = list(configs or [])
+    if config_file:
+        with open(config_file, 'r') as file:
+            lines += [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+    configurations = []
+    for line in lines:
+        name, _, macros = line.rpartition(':')
+        macros = macros.split()
+        name = name.strip() or '_'.join(macros) or 'no_macros'
+        configurations.append((name, macros))
+    return configurations
+
+
+def content_digest(filename):
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:24]
+
+
+def artifact_key(flattened_file, module_index, parse_cache, options):
+    """
+    Hash of everything an artifact schematic is drawn from besides its text: the
+    ports of the modules it instantiates and the schematic, frontend and render options (see hierarchy.page_key).
+    """
+    digest = hashlib.sha256()
+    tables = parse_cache.load_design_tables(flattened_file)
+    for module_name in sorted({instance.module for instance in tables.instances}):
+        digest.update(json.dumps([module_name, module_index.unique_ports(module_name)]).encode())
+    digest.update(json.dumps([options, source_version(generate_schematic)], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def read_stamp(stamp_file):
+    try:
+        with open(stamp_file, 'r') as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the schematics of a design for many macro configurations, rendering identical modules once.")
+    parser.add_argument("-design_dir", required=True, help="Path to all the verilog files")
+    parser.add_argument("-sweep_dir", default="output/sweep", help="Directory of the flattened files, shared artifacts and manifest")
+    parser.add_argument("-config_file", default=None, help="File with one macro configuration per line")
+    parser.add_argument("-config", action="append", help="One macro configuration, can be given several times")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <sweep_dir>/module_index.json)")
+    parser.add_argument("-cache_dir", default=".cache", help="Path to the parser table and parse result cache")
+    parser.add_argument("-jobs", type=int, default=os.cpu_count(), help="Number of worker processes (default: number of cores)")
+    add_schematic_arguments(parser)
+    add_frontend_argument(parser)
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    configurations = read_configurations(args.config_file, args.config)
+    if not configurations:
+        parser.error("give at least one configuration with -config or -config_file")
+    input_files = list(design_files(args.design_dir))
+    artifacts_dir = os.path.join(args.sweep_dir, 'artifacts')
+    os.makedirs(artifacts_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    # Preprocess every file once per configuration, then group identical flattened texts.
+    manifest = {'configurations': {}, 'artifacts': {}}
+    for name, macros in configurations:
+        print(f"Configuration '{name}': {' '.join(macros) or 'no macros'}")
+        flattened_dir = os.path.join(args.sweep_dir, 'flattened', name)
+        os.makedirs(flattened_dir, exist_ok=True)
+        file_pairs = [(input_file, os.path.join(flattened_dir, os.path.splitext(os.path.basename(input_file))[0] + '_flattened_verilog.v'))
+                      for input_file in input_files]
+        flatten_verilog_files(file_pairs, macros, args.jobs)
+        files = {}
+        for input_file, flattened_file in file_pairs:
+            digest = content_digest(flattened_file)
+            artifact = manifest['artifacts'].setdefault(digest, {
+                'flattened': os.path.join(artifacts_dir, digest + '.v'),
+                'schematic': os.path.join(artifacts_dir, digest + ('.dot' if args.dot_only else '.svg')),
+                'used_by': [],
+            })
+            artifact['used_by'].append({'configuration': name, 'file': input_file})
+            if not os.path.exists(artifact['flattened']):
+                replace_with_copy(flattened_file, artifact['flattened'])
+            files[input_file] = digest
+        manifest['configurations'][name] = {'macros': macros, 'files': files}
+
+    # Parse and render every distinct flattened text once, skipping the ones rendered by an earlier sweep
+    # with the same options and the same ports of the instantiated modules (kept in <artifact>.svg.stamp).
+    module_index_file = args.module_index or os.path.join(args.sweep_dir, 'module_index.json')
+    module_index = ModuleIndex.load(args.design_dir, module_index_file)
+    parse_cache = ParseCache(args.cache_dir, frontend=args.frontend)
+    options = dict(schematic_options(args), frontend=args.frontend,
+                   **{name: value for name, value in render_options(args).items() if name != 'record_timings'})
+    task_args = [(artifact['flattened'], os.path.splitext(artifact['schematic'])[0]) for artifact in manifest['artifacts'].values()
+                 if not os.path.exists(artifact['schematic'])
+                 or read_stamp(artifact['schematic'] + '.stamp') != artifact_key(artifact['flattened'], module_index, parse_cache, options)]
+    results = run_in_pool(render_flattened_file, task_args, args.design_dir, module_index_file, args.cache_dir, args.jobs, schematic_options(args),
+                          frontend=args.frontend, render_options=render_options(args))
+    failed = {result['file'] for result in results if result['error']}
+    rendered = {flattened_file for flattened_file, _ in task_args} - failed
+    for artifact in manifest['artifacts'].values():
+        artifact['status'] = 'failed' if artifact['flattened'] in failed else 'ok'
+        if artifact['flattened'] in rendered:
+            # The tables are in the parse cache now, the workers just parsed them
+            with open(artifact['schematic'] + '.stamp', 'w') as file:
+                file.write(artifact_key(artifact['flattened'], module_index, parse_cache, options))
+    parse_cache.save_stats()
+
+    manifest_file = os.path.join(args.sweep_dir, 'manifest.json')
+    with open(manifest_file, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    print_summary(results, time.perf_counter() - start, args.jobs)
+    total = len(configurations) * len(input_files)
+    print(f"{len(configurations)} configuration(s) x {len(input_files)} file(s) = {total} module(s), "
+          f"{len(manifest['artifacts'])} distinct, {len(task_args)} rendered, "
+          f"{len(manifest['artifacts']) - len(task_args)} reused from an earlier sweep")
+    print(f"Manifest saved as '{manifest_file}'")
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+INDEX_VERSION = 1
+VERILOG_EXTENSIONS = ('.v', '.sv', '.vh', '.svh')
+
+# Comments and strings are matched first so that "module" inside them is skipped.
+module_pattern = re.compile(
+    rb'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\bmodule\s+([A-Za-z_][\w$]*)',
+    re.DOTALL,
+)
+endmodule_pattern = re.compile(rb'\bendmodule\b')
+comment_pattern = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+direction_pattern = re.compile(r'^\s*(input|output|inout)\b(.*)$', re.DOTALL)
+identifier_pattern = re.compile(r'[A-Za-z_][\w$]*')
+port_keywords = {'wire', 'reg', 'logic', 'signed', 'unsigned', 'var', 'tri', 'integer'}
+
+
+def default_index_file(design_dir, cache_dir='.cache'):
+    """Index file of a design directory in the cache directory, the design directory itself may be read-only."""
+    key = hashlib.sha1(os.path.abspath(design_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, 'module_index', key + '.json')
+
+
+def _port_names(declaration):
+    """Return the port names of one "<type> [width] a, b" fragment (direction already stripped)."""
+    declaration = re.sub(r'\[[^\]]*\]', ' ', declaration)
+    declaration = declaration.split('=')[0]
+    return [name for name in identifier_pattern.findall(declaration) if name not in port_keywords]
+
+
+def extract_ports_from_text(module_text):
+    """
+    Extract the port directions of a single module from its source text.
+
+    Handles both ANSI headers (directions inside the port list) and non-ANSI
+    bodies (input/output declarations after the header). Inout ports are
+    reported as outputs, the same way the schematic draws them.
+    """
+    ports = {}
+    text = comment_pattern.sub(' ', module_text)
+    header_start = text.find('(')
+    header_end = text.find(';')
+    # Skip a "#(parameter ...)" list so that only the port list is scanned.
+    if header_start != -1 and text[:header_start].rstrip().endswith('#'):
+        depth = 0
+        for i in range(header_start, len(text)):
+            if text[i] == '(':
+                depth += 1
+            elif text[i] == ')':
+                depth -= 1
+                if depth == 0:
+                    header_start = text.find('(', i + 1)
+                    header_end = text.find(';', i + 1)
+                    break
+    if header_start != -1 and header_start < header_end:
+        direction = None
+        for fragment in text[header_start + 1:text.rfind(')', 0, header_end)].split(','):
+            match = direction_pattern.match(fragment)
+            if match:
+                direction = 'output' if match.group(1) == 'inout' else match.group(1)
+                fragment = match.group(2)
+            if direction is not None:
+                for port_name in _port_names(fragment):
+                    ports[port_name] = direction
+    for statement in text[header_end + 1:].split(';'):
+        match = direction_pattern.match(statement)
+        if match:
+            direction = 'output' if match.group(1) == 'inout' else match.group(1)
+            for port_name in _port_names(match.group(2)):
+                ports[port_name] = direction
+    return ports
+
+
+def scan_file(file_path):
+    """Return the sha1 of a file and the module definitions found in it."""
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    modules = []
+    for match in module_pattern.finditer(data):
+        if match.group(1) is None:
+            continue
+        offset = match.start()
+        end = endmodule_pattern.search(data, match.end())
+        end = end.end() if end else len(data)
+        module_text = data[offset:end].decode('utf-8', errors='replace')
+        modules.append({
+            'name': match.group(1).decode(),
+            'offset': offset,
+            'ports': extract_ports_from_text(module_text),
+        })
+    return hashlib.sha1(data).hexdigest(), modules
+
+
+def design_files(design_dir):
+    """Yield every verilog file below the design directory in a stable order."""
+    for root, dirs, files in os.walk(design_dir, followlinks=True):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(VERILOG_EXTENSIONS) and not name.startswith('.'):
+                yield os.path.join(root, name)
+
+
+class ModuleIndex:
+    """
+    Persistent map of module name -> (file, byte offset, ports) for a design directory.
+
+    Every file entry remembers the mtime, size and sha1 it was scanned with, so
+    refresh() only rescans files that actually changed since the index was saved.
+    """
+
+    def __init__(self, design_dir, index_file=None):
+        self.design_dir = design_dir
+        self.index_file = index_file or default_index_file(design_dir)
+        self.files = {}
+        self.modules = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, design_dir, index_file=None):
+        index = cls(design_dir, index_file)
+        try:
+            with open(index.index_file, 'r') as file:
+                data = json.load(file)
+            if data.get('version') == INDEX_VERSION and data.get('design_dir') == os.path.abspath(design_dir):
+                index.files = data['files']
+        except (OSError, ValueError, KeyError):
+            index.files = {}
+        index.refresh()
+        return index
+
+    def refresh(self):
+        """Bring the index up to date with the design directory, rescanning only changed files."""
+        seen = set()
+        for file_path in design_files(self.design_dir):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            seen.add(file_path)
+            entry = self.files.get(file_path)
+            if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                continue
+            sha1, modules = scan_file(file_path)
+            if not (entry and entry['sha1'] == sha1):
+                entry = {'sha1': sha1, 'modules': modules}
+            entry['mtime_ns'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            self.files[file_path] = entry
+            self.dirty = True
+        for file_path in list(self.files):
+            if file_path not in seen:
+                del self.files[file_path]
+                self.dirty = True
+        self.modules = {}
+        for file_path, entry in self.files.items():
+            for module in entry['modules']:
+                self.modules.setdefault(module['name'], []).append((file_path, module))
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'version': INDEX_VERSION, 'design_dir': os.path.abspath(self.design_dir), 'files': self.files}
+        index_dir = os.path.dirname(os.path.abspath(self.index_file))
+        os.makedirs(index_dir, exist_ok=True)
+        # Write to a temporary file first so that parallel make jobs never read a half written index.
+        fd, temp_path = tempfile.mkstemp(dir=index_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.index_file)
+        self.dirty = False
+
+    def lookup(self, module_name):
+        """Return {'file', 'offset', 'ports'} for the module, or None if it is not defined in the design."""
+        definitions = self.modules.get(module_name)
+        if not definitions:
+            return None
+        if len(definitions) > 1:
+            raise ValueError(
+                f"Error: Multiple definitions of module '{module_name}' found in files:\n" +
+                "\n".join(file_path for file_path, _ in definitions)
+            )
+        file_path, module = definitions[0]
+        return {'file': file_path, 'offset': module['offset'], 'ports': module['ports']}
+
+    def unique_ports(self, module_name):
+        """Return the ports of the module, or None if it is not defined or defined several times (for cache keys)."""
+        definitions = self.modules.get(module_name)
+        return definitions[0][1]['ports'] if definitions and len(definitions) == 1 else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the module definition index of a design directory.")
+    parser.add_argument("-design_dir", required=True, help="Path to all the verilog files")
+    parser.add_argument("-module_index", default=None, help="Path to the index file (default: <cache_dir>/module_index/<hash of design_dir>.json)")
+    parser.add_argument("-cache_dir", default=".cache", help="Path to the cache directory of the default index file")
+    args = parser.parse_args()
+
+    index = ModuleIndex.load(args.design_dir, args.module_index or default_index_file(args.design_dir, args.cache_dir))
+    index.save()
+    print(f"Indexed {len(index.modules)} modules from {len(index.files)} files into '{index.index_file}'")
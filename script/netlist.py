@@ -0,0 +1,74 @@
+from array import array
+
+
+class Netlist:
+    """
+    Connectivity of one schematic: for every net, the schematic nodes driving and reading it.
+
+    Net and node names are interned to integer ids and every net keeps compact
+    arrays of driver and reader node ids. The netlist is filled completely before
+    any edge is drawn, so the order in which statements and instances are added
+    does not change the connectivity.
+    """
+
+    def __init__(self):
+        self.net_ids = {}
+        self.net_names = []
+        self.node_ids = {}
+        self.node_names = []
+        self.drivers = []
+        self.readers = []
+        self.input_ports = set()
+        self.output_ports = set()
+
+    def net(self, net_name):
+        """Return the id of a net, creating it on first use."""
+        net_id = self.net_ids.get(net_name)
+        if net_id is None:
+            net_id = self.net_ids[net_name] = len(self.net_names)
+            self.net_names.append(net_name)
+            self.drivers.append(array('I'))
+            self.readers.append(array('I'))
+        return net_id
+
+    def node(self, node_name):
+        """Return the id of a schematic node, creating it on first use."""
+        node_id = self.node_ids.get(node_name)
+        if node_id is None:
+            node_id = self.node_ids[node_name] = len(self.node_names)
+            self.node_names.append(node_name)
+        return node_id
+
+    def add_driver(self, net_name, node_name):
+        self.drivers[self.net(net_name)].append(self.node(node_name))
+
+    def add_reader(self, net_name, node_name):
+        self.readers[self.net(net_name)].append(self.node(node_name))
+
+    def add_input_port(self, net_name):
+        self.input_ports.add(self.net(net_name))
+
+    def add_output_port(self, net_name):
+        self.output_ports.add(self.net(net_name))
+
+    def is_input_port(self, net_name):
+        return self.net_ids.get(net_name) in self.input_ports
+
+    def is_output_port(self, net_name):
+        return self.net_ids.get(net_name) in self.output_ports
+
+    def is_driven(self, net_name):
+        net_id = self.net_ids.get(net_name)
+        return net_id is not None and len(self.drivers[net_id]) > 0
+
+    def is_read(self, net_name):
+        net_id = self.net_ids.get(net_name)
+        return net_id is not None and len(self.readers[net_id]) > 0
+
+    def nets(self):
+        """Yield (net name, driver node names, reader node names) for every net in creation order."""
+        node_names = self.node_names
+        for net_id, net_name in enumerate(self.net_names):
+            yield (net_name,
+                   [node_names[node_id] for node_id in self.drivers[net_id]],
+                   [node_names[node_id] for node_id in self.readers[net_id]])
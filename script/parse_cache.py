@@ -0,0 +1,258 @@
+from pyverilog.vparser.parser import VerilogParser
+from pyverilog.vparser.lexer import VerilogLexer
+from pyverilog.vparser.preprocessor import VerilogPreprocessor
+from ply.yacc import yacc
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import design_tables
+import structural_frontend
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = '.cache'
+
+_parsers = {}
+
+
+class CachedVerilogParser(VerilogParser):
+    """
+    VerilogParser whose LALR tables are pickled once into a fixed directory.
+
+    pyverilog writes parsetab.py into its outputdir but imports the tables from
+    its own package, so PLY regenerates them on every run. A pickle file is read
+    back by PLY directly and is reused by every later run.
+    """
+
+    def __init__(self, parser_dir):
+        self.lexer = VerilogLexer(error_func=self._lexer_error_func)
+        self.lexer.build()
+
+        self.tokens = self.lexer.tokens
+        os.makedirs(parser_dir, exist_ok=True)
+        picklefile = os.path.join(parser_dir, 'parsetab.pickle')
+        if os.path.exists(picklefile):
+            try:
+                self.parser = self._yacc(picklefile)
+                return
+            except (pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, IndexError, KeyError):
+                # A truncated or empty table file (interrupted first run) is rebuilt instead of failing every later run
+                try:
+                    os.remove(picklefile)
+                except OSError:
+                    pass
+        # PLY writes the tables in place: build them in a private directory and move them into place in one step,
+        # so parallel first runs never read half a file
+        with tempfile.TemporaryDirectory(dir=parser_dir) as build_dir:
+            temporary_file = os.path.join(build_dir, 'parsetab.pickle')
+            self.parser = self._yacc(temporary_file)
+            if os.path.exists(temporary_file):
+                os.replace(temporary_file, picklefile)
+
+    def _yacc(self, picklefile):
+        return yacc(
+            module=self,
+            method="LALR",
+            debug=False,
+            picklefile=picklefile
+        )
+
+    def parse(self, text, debug=0):
+        # The parser is reused for many files, every one of them starts at line 1.
+        self.lexer.lexer.lineno = 1
+        return super().parse(text, debug)
+
+
+def get_parser(cache_dir=DEFAULT_CACHE_DIR):
+    """Return the parser of this process, building it (or loading its tables) on first use."""
+    parser = _parsers.get(cache_dir)
+    if parser is None:
+        parser = _parsers[cache_dir] = CachedVerilogParser(os.path.join(cache_dir, 'parser'))
+    return parser
+
+
+def parse_file(filename, macros=(), cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Parse a verilog file and return its AST.
+
+    Flattened files have no compiler directives left, so they are parsed directly
+    instead of being sent through iverilog a second time.
+    """
+    with open(filename, 'r') as file:
+        text = file.read()
+    if '`' in text:
+        with tempfile.TemporaryDirectory() as preprocess_dir:
+            preprocess_output = os.path.join(preprocess_dir, 'preprocess.output')
+            VerilogPreprocessor([filename], preprocess_output, None, list(macros)).preprocess()
+            with open(preprocess_output, 'r') as file:
+                text = file.read()
+    return get_parser(cache_dir).parse(text)
+
+
+def file_digest(filename, macros, version=''):
+    """Key of a cached result: hash of the file content, the macro set and the producer version."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(b'\0' + ' '.join(sorted(macros)).encode())
+    digest.update(b'\0' + f'{CACHE_VERSION}:{version}'.encode())
+    return digest.hexdigest()
+
+
+def source_version(module):
+    """Version string of a python module, so cached results are dropped when its code changes."""
+    with open(module.__file__, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class ParseCache:
+    """
+    Content addressed cache of parse results (the AST or the extracted design tables).
+
+    Every lookup is counted as a hit or a miss per kind, save_stats adds the counts
+    to stats.json in the cache directory once per run, so the counts of a whole
+    make run can be summed afterwards.
+    With keep_in_memory the latest result of every file is also kept in memory,
+    for long running processes that look up the same files again and again.
+    The design tables come from the full parser, or from the structural tokenizer
+    with frontend 'structural'. Lookups from several threads are serialized, the
+    parser of a process can only parse one file at a time.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, keep_in_memory=False, frontend='pyverilog'):
+        self.cache_dir = cache_dir
+        self.frontend = frontend
+        self.hits = 0
+        self.misses = 0
+        # kind -> {'hit': n, 'miss': n} since the last save_stats
+        self.counts = {}
+        # (kind, filename) -> (cache path, result), None when nothing is kept in memory
+        self.memory = {} if keep_in_memory else None
+        self.lock = threading.RLock()
+        # last_lookup.hit tells whether the latest lookup of the calling thread was a hit
+        self.last_lookup = threading.local()
+
+    def _path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, key[:2], key + '.pickle')
+
+    def _record(self, result, kind, filename):
+        self.last_lookup.hit = result == 'hit'
+        if result == 'hit':
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.counts.setdefault(kind, {'hit': 0, 'miss': 0})[result] += 1
+
+    def save_stats(self):
+        """Add the counts since the previous call to stats.json, locked so parallel make jobs can share it."""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, 'stats.json'), 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            try:
+                stats = json.loads(file.read() or '{}')
+            except ValueError:
+                stats = {}
+            for kind, kind_counts in counts.items():
+                for result, count in kind_counts.items():
+                    stats.setdefault(kind, {'hit': 0, 'miss': 0})[result] += count
+            file.truncate(0)
+            file.write(json.dumps(stats))
+
+    def load(self, kind, filename, macros, compute, version=''):
+        """Return the cached result of compute() for this file content and macro set, computing it on a miss."""
+        path = self._path(kind, file_digest(filename, macros, version))
+        with self.lock:
+            if self.memory is not None:
+                kept = self.memory.get((kind, filename))
+                if kept and kept[0] == path:
+                    self._record('hit', kind, filename)
+                    return kept[1]
+                result = self._load(kind, filename, path, compute)
+                self.memory[(kind, filename)] = (path, result)
+                return result
+            return self._load(kind, filename, path, compute)
+
+    def _load(self, kind, filename, path, compute):
+        try:
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+            self._record('hit', kind, filename)
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass
+        self._record('miss', kind, filename)
+        result = compute()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except (RecursionError, pickle.PicklingError):
+            # Extremely deep trees can not be pickled, they are simply not cached.
+            os.remove(temp_path)
+        return result
+
+    def load_ast(self, filename, macros=()):
+        return self.load('ast', filename, macros, lambda: parse_file(filename, macros, self.cache_dir))
+
+    def load_design_tables(self, filename, macros=()):
+        if self.frontend == 'structural':
+            return self.load(
+                'structural_tables', filename, macros,
+                lambda: structural_frontend.scan_design_tables(filename, macros),
+                version=source_version(structural_frontend),
+            )
+        return self.load(
+            'design_tables', filename, macros,
+            lambda: design_tables.collect_design_tables(parse_file(filename, macros, self.cache_dir)),
+            version=source_version(design_tables),
+        )
+
+    def report(self):
+        print(f"Parse cache: {self.hits} hit(s), {self.misses} miss(es)")
+        self.save_stats()
+
+
+def add_frontend_argument(parser):
+    parser.add_argument("-frontend", choices=("pyverilog", "structural"), default="pyverilog",
+                        help="Read the files with the full pyverilog parser or with the faster structural tokenizer (no expression trees)")
+
+
+def read_stats(cache_dir=DEFAULT_CACHE_DIR):
+    """Return {kind: {'hit': n, 'miss': n}} summed over every run logged in the cache directory."""
+    try:
+        with open(os.path.join(cache_dir, 'stats.json'), 'r') as file:
+            return json.loads(file.read() or '{}')
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or reset the hit/miss counts of the parse cache.")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the cache directory")
+    parser.add_argument("-reset", action="store_true", help="Clear the logged counts after printing them")
+    parser.add_argument("-build_parser", action="store_true", help="Only build the parser tables, before parallel runs use them")
+    args = parser.parse_args()
+
+    if args.build_parser:
+        get_parser(args.cache_dir)
+        raise SystemExit(0)
+
+    for kind, counts in sorted(read_stats(args.cache_dir).items()):
+        print(f"{kind}: {counts['hit']} hit(s), {counts['miss']} miss(es)")
+    if args.reset:
+        try:
+            os.remove(os.path.join(args.cache_dir, 'stats.json'))
+        except OSError:
+            pass
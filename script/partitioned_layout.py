@@ -0,0 +1,222 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+# A node ID of the dot source written by the graphviz package: quoted or bare, with an optional :port
+node_id = r'("(?:[^"\\]|\\.)*"|[^\s"\[\]:;=]+)(?::\w+)?'
+edge_pattern = re.compile(rf'^\s*{node_id}\s+->\s+{node_id}')
+node_pattern = re.compile(rf'^\s*{node_id}\s*(\[|$)')
+attribute_pattern = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^\s\]]+)')
+number_pattern = re.compile(r'-?\d+(?:\.\d+)?(?:e-?\d+)?')
+# Space between two partitions of the stitched svg, in points
+PARTITION_GAP = 36
+STATEMENTS = 'statements'
+
+
+def unquote(identifier):
+    return identifier[1:-1].replace('\\"', '"') if identifier.startswith('"') else identifier
+
+
+def attributes(statement):
+    """Return the {name: value} of the attribute list of a node or edge statement."""
+    _, _, attribute_list = statement.partition('[')
+    return {name: unquote(value) for name, value in attribute_pattern.findall(attribute_list)}
+
+
+def split_partitions(schematic):
+    """
+    Split the body of a schematic into independent graphs.
+
+    Every top level instance cluster is one partition, the ports, statements and
+    everything else are the 'statements' partition. Helper nodes (constants,
+    stubs, port arrows) connected to a single instance move to its partition.
+    Return (graph attribute lines, {partition: body lines}, [(edge line, source
+    node, target node)] between partitions).
+    """
+    graph_attributes = []
+    partitions = {STATEMENTS: []}
+    node_partition = {}
+    top_level_nodes = {}
+    edges = []
+    depth = 0
+    current = STATEMENTS
+    for statement in schematic.body:
+        stripped = statement.strip()
+        if stripped.startswith('subgraph ') and stripped.endswith('{'):
+            if depth == 0:
+                name = stripped[len('subgraph '):-1].strip()
+                current = STATEMENTS if name in ('cluster_inputs', 'cluster_outputs') else name
+                partitions.setdefault(current, [])
+            depth += 1
+            partitions[current].append(statement)
+            continue
+        if stripped == '}':
+            depth -= 1
+            partitions[current].append(statement)
+            if depth == 0:
+                current = STATEMENTS
+            continue
+        edge = edge_pattern.match(statement)
+        if edge:
+            edges.append((statement, unquote(edge.group(1)), unquote(edge.group(2))))
+            continue
+        node = node_pattern.match(statement)
+        if node and node.group(1) not in ('graph', 'node', 'edge'):
+            node_partition[unquote(node.group(1))] = current
+            if depth == 0:
+                top_level_nodes[unquote(node.group(1))] = statement
+                continue
+        elif depth == 0:
+            graph_attributes.append(statement)
+            continue
+        partitions[current].append(statement)
+
+    # A top level node whose neighbours are all in the same instance cluster is laid out with that cluster
+    neighbours = {}
+    for _, source, target in edges:
+        neighbours.setdefault(source, set()).add(node_partition.get(target))
+        neighbours.setdefault(target, set()).add(node_partition.get(source))
+    for node_name, statement in top_level_nodes.items():
+        partition_names = neighbours.get(node_name, set())
+        if len(partition_names) == 1 and None not in partition_names:
+            node_partition[node_name] = next(iter(partition_names))
+        partitions[node_partition[node_name]].append(statement)
+
+    between = []
+    for statement, source, target in edges:
+        source_partition = node_partition.get(source, STATEMENTS)
+        target_partition = node_partition.get(target, STATEMENTS)
+        if source_partition == target_partition:
+            partitions[source_partition].append(statement)
+        elif attributes(statement).get('style') != 'invis':
+            between.append((statement, source, target))
+    return graph_attributes, {name: lines for name, lines in partitions.items() if lines}, between
+
+
+def translation(element):
+    """Return the (x, y) of the translate() of an svg transform attribute."""
+    match = re.search(r'translate\(\s*(' + number_pattern.pattern + r')[\s,]+(' + number_pattern.pattern + r')', element.get('transform', ''))
+    return (float(match.group(1)), float(match.group(2))) if match else (0.0, 0.0)
+
+
+def node_boxes(graph_group):
+    """Return {node name: (x0, y0, x1, y1)} of every node of a dot svg, in the coordinates of the svg."""
+    offset_x, offset_y = translation(graph_group)
+    boxes = {}
+    for group in graph_group.iter(f'{{{SVG_NS}}}g'):
+        if group.get('class') != 'node':
+            continue
+        title = group.find(f'{{{SVG_NS}}}title')
+        xs, ys = [], []
+        for shape in group.iter():
+            if shape.tag == f'{{{SVG_NS}}}ellipse':
+                cx, cy, rx, ry = (float(shape.get(name, 0)) for name in ('cx', 'cy', 'rx', 'ry'))
+                xs += [cx - rx, cx + rx]
+                ys += [cy - ry, cy + ry]
+            elif shape.tag in (f'{{{SVG_NS}}}polygon', f'{{{SVG_NS}}}polyline', f'{{{SVG_NS}}}path'):
+                numbers = [float(number) for number in number_pattern.findall(shape.get('points') or shape.get('d') or '')]
+                xs += numbers[0::2]
+                ys += numbers[1::2]
+        if title is not None and xs and ys:
+            boxes[title.text] = (min(xs) + offset_x, min(ys) + offset_y, max(xs) + offset_x, max(ys) + offset_y)
+    return boxes
+
+
+def svg_size(root):
+    view_box = [float(number) for number in root.get('viewBox', '0 0 0 0').split()]
+    return view_box[2], view_box[3]
+
+
+def place_partitions(sizes):
+    """Shelf packing: return {partition: (x, y)} filling rows about as wide as the square root of the total area."""
+    row_width = max(max(width for width, _ in sizes.values()),
+                    1.5 * math.sqrt(sum((width + PARTITION_GAP) * (height + PARTITION_GAP) for width, height in sizes.values())))
+    # The statement region first, then the instance clusters from the tallest down
+    order = sorted(sizes, key=lambda name: (name != STATEMENTS, -sizes[name][1], name))
+    positions = {}
+    x = y = row_height = 0.0
+    for name in order:
+        width, height = sizes[name]
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height + PARTITION_GAP, 0.0
+        positions[name] = (x, y)
+        x += width + PARTITION_GAP
+        row_height = max(row_height, height)
+    return positions
+
+
+def arrow_marker_id(color):
+    return 'stitched_arrow_' + re.sub(r'\W', '_', color)
+
+
+def edge_element(source_box, target_box, attribute_values, title):
+    """A cubic spline from the east side of the source node to the west side of the target node, with its label."""
+    x1, y1 = source_box[2], (source_box[1] + source_box[3]) / 2
+    x2, y2 = target_box[0], (target_box[1] + target_box[3]) / 2
+    bend = max(30.0, abs(x2 - x1) / 2)
+    color = attribute_values.get('color', 'black')
+    group = ET.Element(f'{{{SVG_NS}}}g', {'class': 'edge'})
+    ET.SubElement(group, f'{{{SVG_NS}}}title').text = title
+    ET.SubElement(group, f'{{{SVG_NS}}}path', {
+        'fill': 'none', 'stroke': color, 'marker-end': f'url(#{arrow_marker_id(color)})',
+        'd': f'M{x1:.2f},{y1:.2f} C{x1 + bend:.2f},{y1:.2f} {x2 - bend:.2f},{y2:.2f} {x2:.2f},{y2:.2f}',
+    })
+    if attribute_values.get('label'):
+        label = ET.SubElement(group, f'{{{SVG_NS}}}text', {
+            'text-anchor': 'middle', 'x': f'{(x1 + x2) / 2:.2f}', 'y': f'{(y1 + y2) / 2 - 4:.2f}',
+            'font-family': 'Times,serif', 'font-size': '14.00', 'fill': color,
+        })
+        label.text = attribute_values['label']
+    return group
+
+
+def render_partitioned(schematic, layout, jobs=None):
+    """
+    Lay out every partition of the schematic on its own and stitch them into one svg.
+
+    layout(dot source) returns the svg of one partition, the layouts run in
+    parallel on jobs threads (every layout is a separate graphviz process). The
+    partitions are packed in rows and the edges between them are drawn
+    afterwards as splines from node to node. Return the svg as bytes.
+    """
+    graph_attributes, partitions, between = split_partitions(schematic)
+    sources = {name: 'digraph {\n' + ''.join(graph_attributes) + ''.join(lines) + '}\n' for name, lines in partitions.items()}
+    names = sorted(sources)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        roots = dict(zip(names, (ET.fromstring(svg) for svg in executor.map(lambda name: layout(sources[name]), names))))
+
+    positions = place_partitions({name: svg_size(root) for name, root in roots.items()})
+    width = max(positions[name][0] + svg_size(root)[0] for name, root in roots.items())
+    height = max(positions[name][1] + svg_size(root)[1] for name, root in roots.items())
+    stitched = ET.Element(f'{{{SVG_NS}}}svg', {'width': f'{width:.0f}pt', 'height': f'{height:.0f}pt', 'viewBox': f'0.00 0.00 {width:.2f} {height:.2f}'})
+    definitions = ET.SubElement(stitched, f'{{{SVG_NS}}}defs')
+    for color in sorted({attributes(statement).get('color', 'black') for statement, _, _ in between}):
+        marker = ET.SubElement(definitions, f'{{{SVG_NS}}}marker', {'id': arrow_marker_id(color), 'viewBox': '0 0 10 10', 'refX': '10', 'refY': '5',
+                                                                     'markerWidth': '8', 'markerHeight': '8', 'orient': 'auto'})
+        ET.SubElement(marker, f'{{{SVG_NS}}}path', {'d': 'M0,0 L10,5 L0,10 z', 'fill': color})
+    ET.SubElement(stitched, f'{{{SVG_NS}}}rect', {'width': '100%', 'height': '100%', 'fill': 'white'})
+
+    boxes = {}
+    for index, name in enumerate(names):
+        x, y = positions[name]
+        partition_group = ET.SubElement(stitched, f'{{{SVG_NS}}}g', {'id': f'partition{index}', 'transform': f'translate({x:.2f} {y:.2f})'})
+        for element in roots[name]:
+            # Every partition numbers its nodes, edges and clusters from 1
+            for child in element.iter():
+                if child.get('id'):
+                    child.set('id', f'p{index}_{child.get("id")}')
+            partition_group.append(element)
+            if element.get('class') == 'graph':
+                for node_name, (x0, y0, x1, y1) in node_boxes(element).items():
+                    boxes[node_name] = (x0 + x, y0 + y, x1 + x, y1 + y)
+
+    for statement, source, target in between:
+        if source in boxes and target in boxes:
+            stitched.append(edge_element(boxes[source], boxes[target], attributes(statement), f'{source}->{target}'))
+    return ET.tostring(stitched, encoding='utf-8', xml_declaration=True)
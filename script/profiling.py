@@ -0,0 +1,187 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss
+
+
+def graph_size(schematic):
+    """Return the number of nodes, edges and clusters of a graphviz Digraph from its source lines."""
+    nodes = edges = clusters = 0
+    for line in schematic.body:
+        line = line.strip()
+        if ' -> ' in line:
+            edges += 1
+        elif line.startswith('subgraph cluster'):
+            clusters += 1
+        elif line.endswith(']') and not line.startswith(('graph ', 'node ', 'edge ')):
+            nodes += 1
+    return {'nodes': nodes, 'edges': edges, 'clusters': clusters}
+
+
+class Profiler:
+    """
+    Wall time, call count and peak memory of the named stages of one schematic run.
+
+    Stages can be nested and entered many times (the time of every call is added
+    up), a nested stage records the name of its enclosing stage as its parent. Python allocations are traced with tracemalloc, the peak RSS of this
+    process and of its children (the dot layout) comes from getrusage.
+    tracemalloc is process wide: runs sharing the process with other threads
+    pass trace_memory=False (their traced peak stays 0), and close() stops the
+    tracing this profiler started.
+    """
+
+    def __init__(self, name, trace_memory=True):
+        self.name = name
+        self.stages = {}
+        self.graph = {}
+        self._peaks = []
+        self._stack = []
+        self.start = time.perf_counter()
+        self.trace_memory = trace_memory
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def stage(self, stage_name):
+        stats = self.stages.setdefault(stage_name, {'wall_time': 0.0, 'calls': 0, 'peak_traced_kb': 0, 'peak_rss_kb': 0,
+                                                    'parent': self._stack[-1] if self._stack else None})
+        self._stack.append(stage_name)
+        if not self.trace_memory:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._stack.pop()
+                stats['wall_time'] += time.perf_counter() - start
+                stats['calls'] += 1
+                stats['peak_rss_kb'] = peak_rss_kb()
+            return
+        if self._peaks:
+            # Keep the peak reached so far by the enclosing stage before resetting it for this one.
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            stats['wall_time'] += time.perf_counter() - start
+            stats['calls'] += 1
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            stats['peak_traced_kb'] = max(stats['peak_traced_kb'], peak // 1024)
+            stats['peak_rss_kb'] = peak_rss_kb()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def set_graph(self, schematic):
+        self.graph = graph_size(schematic)
+
+    def report(self):
+        return {
+            'name': self.name,
+            'wall_time': time.perf_counter() - self.start,
+            'peak_rss_kb': peak_rss_kb(),
+            'peak_children_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN),
+            'stages': self.stages,
+            'graph': self.graph,
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def print_summary(self):
+        report = self.report()
+        print(f"Profile of {report['name']}: {report['wall_time']:.3f}s, peak RSS {report['peak_rss_kb'] / 1024:.1f} MB "
+              f"(dot {report['peak_children_rss_kb'] / 1024:.1f} MB)")
+        print(f"  {'stage':16s} {'time':>9s} {'calls':>8s} {'traced MB':>10s}")
+        for stage_name, stats in report['stages'].items():
+            print(f"  {stage_name:16s} {stats['wall_time']:8.3f}s {stats['calls']:8d} {stats['peak_traced_kb'] / 1024:10.1f}")
+        if report['graph']:
+            print(f"  graph: {report['graph']['nodes']} nodes, {report['graph']['edges']} edges, {report['graph']['clusters']} clusters")
+
+
+class NullProfiler:
+    """Stands in for Profiler when profiling is off, every stage is a no-op."""
+
+    _context = nullcontext()
+
+    def stage(self, stage_name):
+        return self._context
+
+    def set_graph(self, schematic):
+        pass
+
+    def close(self):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+def aggregate(report_files, top):
+    """
+    Print the stage totals of many profile reports and the modules that took the most time.
+
+    The share of the total time is given for the top-level stages only, they do
+    not overlap; nested stages are listed under their parent without a share.
+    """
+    reports = []
+    for report_file in report_files:
+        with open(report_file, 'r') as file:
+            reports.append(json.load(file))
+    totals = {}
+    for report in reports:
+        for stage_name, stats in report['stages'].items():
+            total = totals.setdefault(stage_name, {'wall_time': 0.0, 'calls': 0, 'parent': stats.get('parent')})
+            total['wall_time'] += stats['wall_time']
+            total['calls'] += stats['calls']
+    all_time = sum(report['wall_time'] for report in reports)
+    print(f"{len(reports)} profile(s), {all_time:.2f}s in total")
+    print(f"  {'stage':16s} {'time':>9s} {'share':>7s} {'calls':>9s}")
+
+    def print_stages(parent, indent):
+        for stage_name, total in sorted(totals.items(), key=lambda item: -item[1]['wall_time']):
+            if total['parent'] != parent:
+                continue
+            share = f"{100 * total['wall_time'] / max(all_time, 1e-9):6.1f}%" if parent is None else f"{'-':>7s}"
+            print(f"  {' ' * indent + stage_name:16s} {total['wall_time']:8.2f}s {share} {total['calls']:9d}")
+            print_stages(stage_name, indent + 2)
+    print_stages(None, 0)
+    print(f"\nSlowest {min(top, len(reports))} module(s):")
+    for report in sorted(reports, key=lambda report: -report['wall_time'])[:top]:
+        stages = report['stages']
+        slowest = max(stages, key=lambda stage_name: stages[stage_name]['wall_time']) if stages else '-'
+        graph = report.get('graph') or {}
+        print(f"  {report['name']:40s} {report['wall_time']:8.2f}s  slowest stage: {slowest:12s} "
+              f"{graph.get('nodes', 0)} nodes, {graph.get('edges', 0)} edges, peak RSS {report['peak_rss_kb'] / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the profile reports written by generate_schematic.py -profile.")
+    parser.add_argument("reports", nargs="+", help="Profile report files or directories containing *.profile.json files")
+    parser.add_argument("-top", type=int, default=20, help="Number of slowest modules to list")
+    args = parser.parse_args()
+
+    report_files = []
+    for path in args.reports:
+        if os.path.isdir(path):
+            report_files += sorted(glob.glob(os.path.join(path, '**', '*.profile.json'), recursive=True))
+        else:
+            report_files.append(path)
+    aggregate(report_files, args.top)
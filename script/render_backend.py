@@ -0,0 +1,158 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import time
+from partitioned_layout import render_partitioned
+from profiling import graph_size
+
+# Graphviz layout engines the schematics can be rendered with, dot is the only one drawing clusters as boxes in rank order
+ENGINES = ('dot', 'sfdp', 'neato', 'fdp', 'osage')
+# With -record_timings every render attempt is appended to this file in the directory of the schematic
+TIMINGS_FILE = 'render_timings.jsonl'
+
+
+def run_layout(source, engine, timeout=None):
+    """Lay out the dot source with one engine and return the svg, raise TimeoutExpired or CalledProcessError."""
+    return subprocess.run([engine, '-Tsvg'], input=source.encode(), capture_output=True, timeout=timeout, check=True).stdout
+
+
+def layout_with_fallback(source, engine='dot', fallback_engine='sfdp', layout_timeout=0, on_attempt=None):
+    """
+    Return (svg, engine that drew it) of the dot source.
+
+    When the engine takes more than layout_timeout seconds (0: no limit) or fails,
+    the layout is killed and the fallback engine is run without a limit.
+    on_attempt(engine, status, seconds) is called after every attempt.
+    """
+    engines = [engine] if fallback_engine in (None, engine) else [engine, fallback_engine]
+    for attempt, current_engine in enumerate(engines):
+        last = attempt == len(engines) - 1
+        status = 'failed'
+        start = time.perf_counter()
+        try:
+            svg = run_layout(source, current_engine, None if last or not layout_timeout else layout_timeout)
+            status = 'ok'
+            return svg, current_engine
+        except subprocess.TimeoutExpired:
+            status = 'timeout'
+            if last:
+                raise
+            print(f"{current_engine} did not finish in {layout_timeout}s, falling back to {engines[attempt + 1]}")
+        except subprocess.CalledProcessError as error:
+            if last:
+                raise RuntimeError(f"{current_engine} failed: {error.stderr.decode(errors='replace').strip()}") from None
+            print(f"{current_engine} failed, falling back to {engines[attempt + 1]}")
+        finally:
+            if on_attempt:
+                on_attempt(current_engine, status, time.perf_counter() - start)
+
+
+def write_svg(svg, svg_file):
+    """Write the svg through a temporary file, so a failed or killed run never leaves half a schematic."""
+    temporary_file = f"{svg_file}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_file, 'wb') as file:
+            file.write(svg)
+        os.replace(temporary_file, svg_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+def record_timing(filename_schematic, record):
+    with open(os.path.join(os.path.dirname(filename_schematic) or '.', TIMINGS_FILE), 'a') as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def render_with_backend(schematic, filename_schematic, engine='dot', fallback_engine='sfdp', layout_timeout=0, dot_only=False,
+                        partitioned=False, layout_jobs=None, record_timings=False):
+    """
+    Lay out the schematic to <filename_schematic>.svg, or with dot_only only write its source to <filename_schematic>.dot.
+
+    See layout_with_fallback for the engines and the timeout. With partitioned
+    every instance cluster and the statement region are laid out on their own,
+    layout_jobs at a time, and stitched into one svg (see partitioned_layout.py).
+    With record_timings every layout is appended with the size of the graph to render_timings.jsonl.
+    Return the engine that drew the svg, or None for dot_only.
+    """
+    source = schematic.source
+    # Like graphviz' render(), create the output directory
+    os.makedirs(os.path.dirname(filename_schematic) or '.', exist_ok=True)
+    if dot_only:
+        with open(filename_schematic + '.dot', 'w') as file:
+            file.write(source)
+        return None
+    size = graph_size(schematic)
+
+    def on_attempt(used_engine, status, seconds):
+        if record_timings:
+            record_timing(filename_schematic, dict(file=os.path.basename(filename_schematic), engine=used_engine, **size,
+                                                   status=status, seconds=round(seconds, 6)))
+
+    if partitioned:
+        # One record for the whole stitched schematic, the partitions are not recorded one by one
+        used_engine = f"{engine}+partitioned"
+        status = 'failed'
+        start = time.perf_counter()
+        try:
+            svg = render_partitioned(schematic, lambda part_source: layout_with_fallback(part_source, engine, fallback_engine, layout_timeout)[0], layout_jobs)
+            status = 'ok'
+        finally:
+            on_attempt(used_engine, status, time.perf_counter() - start)
+    else:
+        svg, used_engine = layout_with_fallback(source, engine, fallback_engine, layout_timeout, on_attempt)
+    write_svg(svg, filename_schematic + '.svg')
+    return used_engine
+
+
+def add_render_arguments(parser):
+    """Command line options of the layout, shared by every script that renders schematics."""
+    parser.add_argument("-engine", choices=ENGINES, default='dot', help="Graphviz layout engine (default: dot, sfdp or neato are much faster on big graphs)")
+    parser.add_argument("-fallback_engine", choices=ENGINES, default='sfdp', help="Engine used when the layout times out or fails (default: sfdp)")
+    parser.add_argument("-layout_timeout", type=float, default=0, help="Seconds before the layout is killed and the fallback engine is used (default: 0, no limit)")
+    parser.add_argument("-dot_only", action="store_true", help="Only write <output>.dot, to lay it out later or on another machine")
+    parser.add_argument("-partitioned", action="store_true", help="Lay out every instance cluster and the statements on their own, in parallel, and stitch them into one svg")
+    parser.add_argument("-layout_jobs", type=int, default=os.cpu_count(), help="Number of parallel layouts of a -partitioned schematic (default: number of cores)")
+    parser.add_argument("-record_timings", action="store_true", help=f"Append the engine, graph size and time of every layout to {TIMINGS_FILE}, for make render_report")
+
+
+def render_options(args):
+    return {"engine": args.engine, "fallback_engine": args.fallback_engine, "layout_timeout": args.layout_timeout, "dot_only": args.dot_only,
+            "partitioned": args.partitioned, "layout_jobs": args.layout_jobs, "record_timings": args.record_timings}
+
+
+def timing_report(timing_files):
+    """Print the median layout time of every engine for every size of graph, and how often it timed out or failed."""
+    groups = {}
+    for timing_file in timing_files:
+        with open(timing_file, 'r') as file:
+            for line in file:
+                record = json.loads(line)
+                # Graphs are grouped by the order of magnitude of their node count
+                groups.setdefault((len(str(max(record['nodes'], 1))), record['engine']), []).append(record)
+    print(f"{'nodes':>9s} {'engine':8s} {'runs':>6s} {'median':>9s} {'max':>9s} {'timeout':>8s} {'failed':>7s}")
+    for (digits, engine), records in sorted(groups.items()):
+        bucket = f"<{10 ** digits}"
+        seconds = [record['seconds'] for record in records if record['status'] == 'ok']
+        timeouts = sum(record['status'] == 'timeout' for record in records)
+        failures = sum(record['status'] == 'failed' for record in records)
+        median = f"{statistics.median(seconds):8.2f}s" if seconds else f"{'-':>9s}"
+        longest = f"{max(seconds):8.2f}s" if seconds else f"{'-':>9s}"
+        print(f"{bucket:>9s} {engine:8s} {len(records):6d} {median} {longest} {timeouts:8d} {failures:7d}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the layout time of the graphviz engines from the render_timings.jsonl files.")
+    parser.add_argument("timings", nargs="+", help="render_timings.jsonl files or directories containing them")
+    args = parser.parse_args()
+
+    timing_files = []
+    for path in args.timings:
+        if os.path.isdir(path):
+            timing_files += sorted(glob.glob(os.path.join(path, '**', TIMINGS_FILE), recursive=True))
+        else:
+            timing_files.append(path)
+    timing_report(timing_files)
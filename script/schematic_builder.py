@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from export_netlist import export_netlist
+from generate_schematic import create_schematic_from_tables, render_schematic
+from module_index import ModuleIndex, default_index_file
+from parse_cache import ParseCache, DEFAULT_CACHE_DIR, get_parser
+from profiling import Profiler, null_profiler
+
+
+def run_stage(result, stage, function, *args, **kwargs):
+    """Run one pipeline stage, recording its wall time (also when it fails) in result."""
+    result['stage'] = stage
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        result['timings'][stage] = time.perf_counter() - start
+
+
+class BuildContext:
+    """
+    Everything one schematic run reads and produces.
+
+    The file, its options, the module index the run started with, its profiler,
+    and what it produced: the design tables, the schematic and the result
+    ({'file', 'timings', 'error'}, the stage being run and whether the parse
+    cache hit). Nothing in it is shared with other runs.
+    """
+
+    def __init__(self, input_file, output, macros, module_index, options, render_options, export, render, profile, result=None, trace_memory=True):
+        self.input_file = input_file
+        self.output = output
+        self.macros = list(macros)
+        self.module_index = module_index
+        self.options = options
+        self.render_options = render_options
+        self.export = export
+        self.render = render
+        self.profiler = Profiler(os.path.basename(input_file), trace_memory) if profile else null_profiler
+        self.result = result if result is not None else {'file': input_file, 'timings': {}, 'error': None}
+        self.tables = None
+        self.schematic = None
+
+
+class SchematicBuilder:
+    """
+    Builds the schematics of one design for any number of files, one after the other or on several threads.
+
+    The module index, the parse cache and the parser tables are loaded once and
+    shared by every run, the source text comes from the process wide cache of
+    source_buffer.py. Runs only read them (the parse cache and the source buffer
+    cache lock themselves), so a service can keep one builder for thousands of
+    files. On threads the dot layouts run in parallel, parsing one file at a time.
+    """
+
+    def __init__(self, design_dir, module_index_file=None, cache_dir=DEFAULT_CACHE_DIR, frontend='pyverilog', keep_in_memory=False,
+                 options=None, render_options=None, export=(), render=True, profile=False):
+        self.design_dir = design_dir
+        self.options = options or {}
+        self.render_options = render_options or {}
+        self.export = export
+        self.render = render
+        self.profile = profile
+        self.module_index = ModuleIndex.load(design_dir, module_index_file or default_index_file(design_dir, cache_dir))
+        self.parse_cache = ParseCache(cache_dir, keep_in_memory, frontend)
+        if frontend == 'pyverilog':
+            get_parser(cache_dir)
+        self._index_lock = threading.Lock()
+
+    def refresh_module_index(self):
+        """
+        Rescan the changed design files into a new module index and save it.
+
+        Runs already started keep the index they started with, the next ones get the new one.
+        """
+        with self._index_lock:
+            module_index = ModuleIndex(self.design_dir, self.module_index.index_file)
+            module_index.files = {file_path: dict(entry) for file_path, entry in self.module_index.files.items()}
+            module_index.refresh()
+            module_index.save()
+            self.module_index = module_index
+        return module_index
+
+    def context(self, input_file, output, macros=(), result=None, trace_memory=True, **options):
+        """Return the context of one run, options override the schematic options of the builder."""
+        return BuildContext(input_file, output, macros, self.module_index, dict(self.options, **options), self.render_options,
+                            self.export, self.render, self.profile, result, trace_memory)
+
+    def build(self, context):
+        """Parse (or load from the cache) the file of a context, export its netlist and build its schematic."""
+        result = context.result
+        profiler = context.profiler
+        with profiler.stage('parse'):
+            context.tables = run_stage(result, 'parse', self.parse_cache.load_design_tables, context.input_file, context.macros)
+        result['cache_hit'] = self.parse_cache.last_lookup.hit
+        if context.export:
+            with profiler.stage('export'):
+                run_stage(result, 'export', export_netlist, context.tables, context.input_file, context.module_index, context.output, context.export)
+        if context.render:
+            with profiler.stage('build'):
+                context.schematic = run_stage(result, 'build', create_schematic_from_tables, context.tables, context.input_file,
+                                              context.module_index, profiler=profiler, **context.options)
+            profiler.set_graph(context.schematic)
+        return context
+
+    def render_context(self, context):
+        """Lay out the schematic of a built context and save its profile."""
+        with context.profiler.stage('render'):
+            run_stage(context.result, 'render', render_schematic, context.schematic, context.output, **context.render_options)
+        if self.profile:
+            context.profiler.save(context.output + '.profile.json')
+
+    def run(self, input_file, output, macros=(), result=None, trace_memory=True, **options):
+        """Build and render one file and return its context, the error of a failed stage is raised (result['stage'] tells which)."""
+        context = self.context(input_file, output, macros, result, trace_memory, **options)
+        try:
+            self.build(context)
+            if context.render:
+                self.render_context(context)
+        finally:
+            context.profiler.close()
+        return context
+
+    def run_many(self, tasks, jobs=None):
+        """
+        Run every (input_file, output) or (input_file, output, macros) task on a pool of threads and return their results.
+
+        A failed file does not stop the others, its error is in its result. The
+        profiles only have times and RSS, the traced memory of threads running
+        at the same time can not be told apart.
+        """
+        def run_task(task):
+            result = {'file': task[0], 'timings': {}, 'error': None}
+            try:
+                self.run(*task, result=result, trace_memory=False)
+            except Exception:
+                result['error'] = f"{result.get('stage')}: {traceback.format_exc(limit=3).strip().splitlines()[-1]}"
+            return result
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(run_task, tasks))
@@ -0,0 +1,129 @@
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+# Comments and strings are single tokens, so "begin"/"end" inside them never count.
+token_pattern = re.compile(
+    rb'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\\\S+|[A-Za-z_][\w$]*|;',
+    re.DOTALL,
+)
+block_openers = {b'begin', b'case', b'casex', b'casez', b'fork'}
+block_closers = {b'end', b'endcase', b'join', b'join_any', b'join_none'}
+
+# Files kept mapped by a long running process, the least recently used one is dropped beyond this
+MAX_SOURCE_BUFFERS = 64
+_source_buffers = OrderedDict()
+_source_buffers_lock = threading.Lock()
+
+
+class SourceBuffer:
+    """
+    A source file read once (memory-mapped) together with the byte offset of every line.
+
+    Line numbers are 1-based like the lineno of pyverilog nodes, so getting the
+    text of a statement is a slice of the mapped file instead of a re-read.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            # The file version this buffer was read from
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            try:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can not be memory-mapped.
+                self.data = b''
+        self.line_offsets = array('Q', [0])
+        self.line_offsets.extend(match.end() for match in re.finditer(rb'\n', self.data))
+        if self.line_offsets[-1] != len(self.data):
+            self.line_offsets.append(len(self.data))
+
+    @property
+    def line_count(self):
+        return len(self.line_offsets) - 1
+
+    def line_start(self, lineno):
+        return self.line_offsets[max(lineno, 1) - 1]
+
+    def lineno_at(self, offset):
+        """Return the line number containing the given byte offset."""
+        low, high = 0, self.line_count - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.line_offsets[middle] <= offset:
+                low = middle
+            else:
+                high = middle - 1
+        return low + 1
+
+    def lines(self, start_lineno, end_lineno):
+        """Return the text of lines start_lineno..end_lineno, both included."""
+        end_lineno = min(end_lineno, self.line_count)
+        if start_lineno > end_lineno:
+            return ''
+        start = self.line_offsets[start_lineno - 1]
+        end = self.line_offsets[end_lineno]
+        return self.data[start:end].decode('utf-8', errors='replace')
+
+    def statement_end_lineno(self, start_lineno):
+        """
+        Return the last line of the procedural statement that starts on start_lineno.
+
+        The statement ends at a ';' or at the end/endcase/join that closes its
+        outermost block, unless the next token is an 'else' that continues it.
+        """
+        depth = 0
+        statement_done = False
+        last_end = self.line_start(start_lineno)
+        for match in token_pattern.finditer(self.data, last_end):
+            token = match.group(0)
+            if token.startswith((b'//', b'/*')):
+                continue
+            if statement_done:
+                if token != b'else':
+                    break
+                statement_done = False
+            last_end = match.end()
+            if token in block_openers:
+                depth += 1
+            elif token in block_closers:
+                depth -= 1
+                statement_done = depth <= 0
+            elif token == b';' and depth <= 0:
+                statement_done = True
+        return self.lineno_at(max(last_end - 1, 0))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def get_source_buffer(filename):
+    """
+    Return the SourceBuffer of a file, reading and indexing it only on first use.
+
+    It can be called from several threads at once. A file that changed since it
+    was read is read again. Only the MAX_SOURCE_BUFFERS most recently used files
+    are kept, a dropped or replaced buffer is not closed: it stays valid for the
+    builds still using it and is unmapped when the last of them lets it go.
+    """
+    stat = os.stat(filename)
+    with _source_buffers_lock:
+        source_buffer = _source_buffers.get(filename)
+        if source_buffer is None or source_buffer.stamp != (stat.st_mtime_ns, stat.st_size):
+            source_buffer = _source_buffers[filename] = SourceBuffer(filename)
+        _source_buffers.move_to_end(filename)
+        while len(_source_buffers) > MAX_SOURCE_BUFFERS:
+            _source_buffers.popitem(last=False)
+    return source_buffer
+
+
+def close_source_buffers():
+    """Drop every cached SourceBuffer, the ones still used by a build are unmapped when it is done with them."""
+    with _source_buffers_lock:
+        _source_buffers.clear()
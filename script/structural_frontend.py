@@ -0,0 +1,396 @@
+import mmap
+import os
+import re
+import tempfile
+from pyverilog.vparser.ast import IntConst
+from pyverilog.vparser.preprocessor import VerilogPreprocessor
+from design_tables import DesignTables, Statement, PortConnection, Instance
+
+# One token per match: newlines are tokens of their own so the line number is
+# counted on the way, comments and directives are skipped as a whole.
+token_pattern = re.compile(
+    rb'(?P<newline>\n)|(?P<space>[ \t\r\f]+)|(?P<comment>//[^\n]*|/\*.*?\*/)|(?P<directive>`[^\n]*)'
+    rb'|(?P<token>"(?:\\.|[^"\\\n])*"|\d*\s*\'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ_?]+|\d[\d_]*(?:\.\d+)?|\$?[A-Za-z_][\w$]*|\\\S+'
+    rb'|===|!==|<<<|>>>|<=|>=|==|!=|&&|\|\||<<|>>|\*\*|\+:|-:|->|.)',
+    re.DOTALL,
+)
+keywords = {
+    'always', 'always_comb', 'always_ff', 'always_latch', 'and', 'assign', 'automatic', 'begin', 'case', 'casex', 'casez',
+    'default', 'defparam', 'disable', 'edge', 'else', 'end', 'endcase', 'endfunction', 'endgenerate', 'endmodule', 'endtask',
+    'for', 'forever', 'fork', 'function', 'generate', 'genvar', 'if', 'initial', 'inout', 'input', 'integer', 'join',
+    'localparam', 'logic', 'macromodule', 'module', 'negedge', 'or', 'output', 'parameter', 'posedge', 'real', 'reg',
+    'repeat', 'signed', 'supply0', 'supply1', 'task', 'time', 'tri', 'unsigned', 'wait', 'wand', 'while', 'wire', 'wor',
+}
+net_keywords = {'wire', 'reg', 'logic', 'tri', 'wand', 'wor', 'supply0', 'supply1'}
+direction_kinds = {'input': 'Input', 'output': 'Output', 'inout': 'Inout'}
+declaration_keywords = set(direction_kinds) | net_keywords | {'integer', 'real', 'time', 'genvar', 'parameter', 'localparam'}
+procedural_keywords = {'always', 'always_comb', 'always_ff', 'always_latch', 'initial'}
+block_openers = {'begin', 'case', 'casex', 'casez', 'fork'}
+block_closers = {'end', 'endcase', 'join', 'join_any', 'join_none'}
+skipped_blocks = {'function': 'endfunction', 'task': 'endtask'}
+# Gate primitives are instances of the module 'and', 'or', ... like in the AST, 'and' and 'or' are also keywords
+gate_primitives = {'and', 'nand', 'or', 'nor', 'xor', 'xnor', 'buf', 'not', 'bufif0', 'bufif1', 'notif0', 'notif1'}
+
+
+def tokenize(data):
+    """Yield (token, line number) for every token of the mapped file, without ever holding more than one token."""
+    lineno = 1
+    for match in token_pattern.finditer(data):
+        kind = match.lastgroup
+        if kind == 'newline':
+            lineno += 1
+        elif kind == 'token':
+            yield match.group(kind).decode('utf-8', errors='replace'), lineno
+        elif kind == 'comment':
+            lineno += match.group(kind).count(b'\n')
+
+
+class TokenStream:
+    """Tokens of a file with one token of look-ahead."""
+
+    def __init__(self, data):
+        self.tokens = tokenize(data)
+        self.peeked = None
+        self.lineno = 1
+
+    def next(self):
+        """Return the next token, its line number is in self.lineno."""
+        if self.peeked is not None:
+            (token, self.lineno), self.peeked = self.peeked, None
+            return token
+        token, self.lineno = next(self.tokens, (None, self.lineno))
+        return token
+
+    def peek(self):
+        if self.peeked is None:
+            self.peeked = next(self.tokens, (None, self.lineno))
+        return self.peeked[0]
+
+    def group(self, opener='(', closer=')'):
+        """Return the tokens up to the closer matching an opener that was just read."""
+        tokens = []
+        depth = 1
+        while True:
+            token = self.next()
+            if token is None:
+                return tokens
+            if token == opener:
+                depth += 1
+            elif token == closer:
+                depth -= 1
+                if depth == 0:
+                    return tokens
+            tokens.append(token)
+
+    def until(self, end=';'):
+        """Return the tokens up to the next end token outside of brackets."""
+        tokens = []
+        depth = 0
+        while True:
+            token = self.next()
+            if token is None or (token == end and depth == 0):
+                return tokens
+            if token in ('(', '[', '{'):
+                depth += 1
+            elif token in (')', ']', '}'):
+                depth -= 1
+            tokens.append(token)
+
+
+def split_top_level(tokens, separator=','):
+    """Split a token list at the separators that are not inside brackets."""
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if token in ('(', '[', '{'):
+            depth += 1
+        elif token in (')', ']', '}'):
+            depth -= 1
+        if token == separator and depth == 0:
+            parts.append([])
+        else:
+            parts[-1].append(token)
+    return parts
+
+
+def is_signal(token):
+    return (token[0].isalpha() or token[0] in '_\\') and token not in keywords
+
+
+def is_value(token):
+    return token[0].isdigit() or token[0] == "'"
+
+
+def signals_and_values(tokens):
+    """The identifiers and literals of an expression, what the AST walk adds to the inputs of a statement."""
+    return {token for token in tokens if is_signal(token) or is_value(token)}
+
+
+def bound(tokens):
+    """A width or part-select bound as an IntConst holding its text, comparable like the nodes of the full parser."""
+    return IntConst("".join(tokens))
+
+
+def range_bounds(tokens):
+    """Return (msb, lsb) of the tokens of a [msb:lsb] range (without the brackets), None for a single index."""
+    parts = split_top_level(tokens, ':')
+    if len(parts) != 2:
+        return None
+    return bound(parts[0]), bound(parts[1])
+
+
+def port_connection(portname, tokens):
+    """PortConnection of an instance port connected to an expression, like design_tables.instance_record."""
+    if not tokens:
+        return PortConnection(portname, 'None', None, None)
+    if len(tokens) > 3 and is_signal(tokens[0]) and tokens[1] == '[' and tokens[-1] == ']':
+        bounds = range_bounds(tokens[2:-1])
+        if bounds:
+            return PortConnection(portname, tokens[0], bounds[0], bounds[1])
+        return PortConnection(portname, tokens[0], None, None)
+    return PortConnection(portname, "".join(tokens), None, None)
+
+
+class StructuralScanner:
+    """
+    Fill a DesignTables from the tokens of a file without building an AST.
+
+    Module headers (ANSI and non-ANSI), declarations, continuous assigns, the
+    signals read and driven by always blocks and the port maps of instances are
+    recognised from the token stream. Anything else (functions, tasks, parameters,
+    initial blocks) is skipped, so only the tables grow with the file size.
+    Wire declarations with an assignment are numbered among themselves, the
+    full parser numbers them among all the declarations.
+    """
+
+    def __init__(self, data):
+        self.stream = TokenStream(data)
+        self.tables = DesignTables()
+        self.counters = {'always': 0, 'assign': 0, 'wire': 0}
+
+    def scan(self):
+        while True:
+            token = self.stream.next()
+            if token is None:
+                break
+            if token in ('module', 'macromodule'):
+                self.module()
+        for statement in self.tables.statements:
+            statement.inputs.difference_update(statement.outputs)
+        return self.tables
+
+    def statement(self, kind, lineno):
+        statement = Statement(kind, f"{kind}_{self.counters[kind]}", lineno, set(), set())
+        self.counters[kind] += 1
+        self.tables.statements.append(statement)
+        return statement
+
+    def declare(self, kind, name, width):
+        self.tables.declarations[name] = 0 if width is None else {'msb': width[0], 'lsb': width[1]}
+        if kind == 'Input':
+            self.tables.input_ports.append(name)
+        elif kind == 'Output':
+            self.tables.output_ports.append(name)
+
+    def module(self):
+        stream = self.stream
+        stream.next()  # module name
+        if stream.peek() == '#':
+            stream.next()
+            stream.next()
+            stream.group()
+        if stream.peek() == '(':
+            stream.next()
+            self.ansi_ports(stream.group())
+        stream.until(';')
+        while True:
+            token = stream.next()
+            if token is None or token == 'endmodule':
+                return
+            lineno = stream.lineno
+            if token in declaration_keywords:
+                self.declaration(token, lineno)
+            elif token == 'assign':
+                self.assign(stream.until(';'), lineno)
+            elif token in procedural_keywords:
+                self.procedural(token, lineno)
+            elif token in skipped_blocks:
+                end = skipped_blocks[token]
+                while token is not None and token != end:
+                    token = stream.next()
+            elif token in ('generate', 'endgenerate', 'end', 'else'):
+                continue
+            elif token == 'begin':
+                if stream.peek() == ':':
+                    stream.next()
+                    stream.next()
+            elif token in ('for', 'if', 'case'):
+                if stream.next() == '(':
+                    stream.group()
+            elif (token in gate_primitives or is_signal(token)) and stream.peek() not in ('=', '<=', '.'):
+                self.instance(token, lineno)
+            elif token != ';':
+                stream.until(';')
+
+    def ansi_ports(self, tokens):
+        """Declare the ports of an ANSI header, a port without direction keeps the direction and width of the one before."""
+        kind = None
+        width = None
+        for item in split_top_level(tokens):
+            if item and item[0] in direction_kinds:
+                kind = direction_kinds[item[0]]
+                width = None
+                if '[' in item:
+                    start = item.index('[')
+                    width = range_bounds(item[start + 1:item.index(']', start)])
+                if 'reg' in item:
+                    self.tables.declarations.setdefault(item[-1], 0)
+            names = [token for token in item if is_signal(token)]
+            if kind and names:
+                self.declare(kind, names[-1], width)
+
+    def declaration(self, keyword, lineno):
+        """A declaration statement: every name is declared and a wire with an assignment is also a statement."""
+        tokens = self.stream.until(';')
+        if keyword not in direction_kinds and keyword not in net_keywords:
+            return
+        kinds = [direction_kinds.get(keyword, keyword)]
+        width = None
+        width_tokens = []
+        position = 0
+        while position < len(tokens) and (tokens[position] in keywords or tokens[position] == '['):
+            if tokens[position] == '[' and width is None:
+                end = tokens.index(']', position)
+                width_tokens = tokens[position + 1:end]
+                width = range_bounds(width_tokens)
+                position = end
+            elif tokens[position] in net_keywords:
+                kinds.append(tokens[position])
+            position += 1
+        statement = None
+        for item in split_top_level(tokens[position:]):
+            if not item or not is_signal(item[0]):
+                continue
+            for kind in kinds:
+                self.declare(kind, item[0], width)
+            if '=' in item:
+                expression = item[item.index('=') + 1:]
+                if statement is None:
+                    statement = self.statement('wire', lineno)
+                    statement.inputs.update(token for token in width_tokens if is_value(token))
+                statement.inputs.update(signals_and_values(expression))
+                statement.outputs.add(item[0])
+                assign = self.statement('assign', lineno)
+                assign.inputs.update(signals_and_values(expression))
+                assign.outputs.add(item[0])
+
+    def assign(self, tokens, lineno):
+        for item in split_top_level(tokens):
+            if '=' not in item:
+                continue
+            split = item.index('=')
+            lvalue = [token for token in item[:split] if is_signal(token)]
+            statement = self.statement('assign', lineno)
+            statement.inputs.update(signals_and_values(item))
+            if lvalue:
+                statement.outputs.add(lvalue[0])
+
+    def procedural(self, keyword, lineno):
+        """
+        An always (or initial) block, read up to the end of its statement.
+
+        Every identifier and literal is an input and the first identifier of every
+        assignment target is an output, like the Lvalue rule of the AST walk.
+        """
+        stream = self.stream
+        statement = self.statement('always', lineno) if keyword != 'initial' else Statement('initial', '', lineno, set(), set())
+        depth = 0
+        parens = 0
+        target = None
+        in_rhs = False
+        while True:
+            token = stream.next()
+            if token is None:
+                break
+            if token in ('(', '[', '{'):
+                parens += 1
+            elif token in (')', ']', '}'):
+                parens -= 1
+                if parens == 0 and token == ')' and not in_rhs:
+                    target = None
+            elif parens == 0 and token in ('=', '<=') and not in_rhs:
+                if target:
+                    statement.outputs.add(target)
+                in_rhs = True
+            elif parens == 0 and token == ':' and not in_rhs:
+                target = None
+            elif token in block_openers:
+                depth += 1
+                target = None
+                if token == 'begin' and stream.peek() == ':':
+                    stream.next()
+                    stream.next()
+            elif token in block_closers or (token == ';' and parens == 0):
+                if token in block_closers:
+                    depth -= 1
+                target = None
+                in_rhs = False
+                if depth <= 0 and stream.peek() != 'else':
+                    break
+            elif token == 'else':
+                target = None
+            elif is_signal(token) or is_value(token):
+                statement.inputs.add(token)
+                if target is None and not in_rhs and is_signal(token):
+                    target = token
+
+    def instance(self, module_name, lineno):
+        """
+        An instantiation, only its first instance is recorded like in design_tables.instance_record.
+
+        Instances without a name (gate primitives) get the name '', and an empty
+        positional port keeps its place with an unconnected PortConnection.
+        """
+        stream = self.stream
+        if stream.peek() == '#':
+            stream.next()
+            if stream.next() == '(':
+                stream.group()
+        instance_name = '' if stream.peek() == '(' else stream.next()
+        if stream.peek() == '[':
+            stream.next()
+            stream.group('[', ']')
+        if stream.next() != '(':
+            stream.until(';')
+            return
+        port_tokens = stream.group()
+        ports = []
+        for item in split_top_level(port_tokens) if port_tokens else []:
+            if item and item[0] == '.':
+                ports.append(port_connection(item[1], item[3:-1] if len(item) > 2 else [item[1]]))
+            else:
+                ports.append(port_connection(None, item))
+        stream.until(';')
+        self.tables.instances.append(Instance(instance_name, module_name, lineno, ports))
+
+
+def scan_mapped_file(filename):
+    """Scan a file through a memory map, so only the current token and statement are ever held in memory."""
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return DesignTables()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return StructuralScanner(data).scan()
+
+
+def scan_design_tables(filename, macros=()):
+    """Return the DesignTables of a verilog file read with the structural tokenizer instead of the full parser."""
+    with open(filename, 'rb') as file:
+        has_directives = any(b'`' in chunk for chunk in iter(lambda: file.read(1 << 20), b''))
+    if not has_directives:
+        return scan_mapped_file(filename)
+    # Like parse_file, only files still holding compiler directives go through the preprocessor
+    with tempfile.TemporaryDirectory() as preprocess_dir:
+        preprocess_output = os.path.join(preprocess_dir, 'preprocess.output')
+        VerilogPreprocessor([filename], preprocess_output, None, list(macros)).preprocess()
+        return scan_mapped_file(preprocess_output)
@@ -0,0 +1,118 @@
+import argparse
+import os
+import time
+from batch import init_worker, output_files, process_file, worker
+from generate_schematic import add_schematic_arguments, schematic_options
+from module_index import design_files
+from parse_cache import DEFAULT_CACHE_DIR, add_frontend_argument
+from render_backend import add_render_arguments, render_options
+
+
+def snapshot(design_dir):
+    """Return {file: (mtime_ns, size)} of every verilog file of the design directory (symlinks are followed)."""
+    files = {}
+    for input_file in design_files(design_dir):
+        try:
+            stat = os.stat(input_file)
+        except OSError:
+            continue
+        files[input_file] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def module_ports(module_index):
+    """Return {module name: ports} of every module of the index, the port view instances are drawn from."""
+    return {module_name: [module['ports'] for _, module in definitions] for module_name, definitions in module_index.modules.items()}
+
+
+def instantiated_modules(input_file, output_dir, macros):
+    """Return the names of the modules instantiated by a design file, from the tables kept in memory."""
+    flattened_file, _ = output_files(input_file, output_dir)
+    try:
+        tables = worker['parse_cache'].load_design_tables(flattened_file, macros)
+    except Exception:
+        return set()
+    return {instance.module for instance in tables.instances}
+
+
+def is_up_to_date(input_file, output_dir, dot_only=False):
+    """Whether what the render mode writes (the .svg, or the .dot with dot_only) is newer than the design file."""
+    _, output = output_files(input_file, output_dir)
+    try:
+        return os.path.getmtime(output + ('.dot' if dot_only else '.svg')) >= os.path.getmtime(input_file)
+    except OSError:
+        return False
+
+
+def render(input_files, output_dir, macros, reason):
+    """Flatten, parse and render the files one after the other and print how long each took."""
+    for input_file in sorted(input_files):
+        result = process_file(input_file, output_dir, macros)
+        timings = " ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result['timings'].items())
+        status = 'FAILED ' + result['error'] if result['error'] else 'ok'
+        print(f"[{time.strftime('%H:%M:%S')}] {os.path.basename(input_file)} ({reason}): {timings}, "
+              f"total {sum(result['timings'].values()):.2f}s  {status}", flush=True)
+
+
+def watch(design_dir, output_dir, macros, interval):
+    """
+    Poll the design directory and re-render every file whose content changed.
+
+    When the ports of a module change, the files instantiating that module are
+    rendered again as well, since their instance clusters show those ports.
+    """
+    builder = worker['builder']
+    files = snapshot(design_dir)
+    instances = {input_file: instantiated_modules(input_file, output_dir, macros) for input_file in files}
+    print(f"Watching {len(files)} file(s) in '{design_dir}' every {interval}s, press Ctrl-C to stop", flush=True)
+    while True:
+        time.sleep(interval)
+        current = snapshot(design_dir)
+        changed = {input_file for input_file, stamp in current.items() if files.get(input_file) != stamp}
+        removed = set(files) - set(current)
+        files = current
+        if not changed and not removed:
+            continue
+
+        old_ports = module_ports(builder.module_index)
+        worker['module_index'] = builder.refresh_module_index()
+        new_ports = module_ports(builder.module_index)
+        changed_modules = {module_name for module_name in old_ports.keys() | new_ports.keys() if old_ports.get(module_name) != new_ports.get(module_name)}
+
+        render(changed, output_dir, macros, 'changed')
+        for input_file in removed:
+            instances.pop(input_file, None)
+        for input_file in changed:
+            instances[input_file] = instantiated_modules(input_file, output_dir, macros)
+        parents = {input_file for input_file, modules in instances.items() if modules & changed_modules} - changed
+        if parents:
+            render(parents, output_dir, macros, f"ports of {' '.join(sorted(changed_modules))} changed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the schematics of a design up to date, re-rendering files as soon as they are saved.")
+    parser.add_argument("-design_dir", required=True, help="Path to all the verilog files")
+    parser.add_argument("-output_dir", default="output", help="Path to the output directory")
+    parser.add_argument("-macros", default="", help="Macros used to flatten the verilog files, if any.")
+    parser.add_argument("-module_index", default=None, help="Path to the module index file (default: <output_dir>/module_index.json)")
+    parser.add_argument("-cache_dir", default=DEFAULT_CACHE_DIR, help="Path to the parser table and parse result cache")
+    parser.add_argument("-interval", type=float, default=0.3, help="Seconds between two scans of the design directory")
+    add_schematic_arguments(parser)
+    add_frontend_argument(parser)
+    add_render_arguments(parser)
+    args = parser.parse_args()
+
+    macros = args.macros.split()
+    module_index_file = args.module_index or os.path.join(args.output_dir, 'module_index.json')
+    for directory in ('flatten_verilog_files', 'schematic_files'):
+        os.makedirs(os.path.join(args.output_dir, directory), exist_ok=True)
+
+    # The parser, the module index and the tables of every file stay loaded in this process
+    init_worker(args.design_dir, module_index_file, args.cache_dir, schematic_options(args), False, (), True, args.frontend, render_options(args), True)
+    worker['module_index'].save()
+    render([input_file for input_file in design_files(args.design_dir) if not is_up_to_date(input_file, args.output_dir, args.dot_only)],
+           args.output_dir, macros, 'out of date')
+    try:
+        watch(args.design_dir, args.output_dir, macros, args.interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching")